@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Benchmarks for OpenExchangeRates Client for Python 3.6+.
+
+Runs against Replayer, the local stand-in of the API, with full size fixtures.
+
+python benchmarks.py --json results.json"""
+
+
+import argparse
+import importlib.util
+import os
+import platform
+import subprocess
+import sys
+import timeit
+import tracemalloc
+from array import array
+from collections import namedtuple
+from json import dump, dumps, loads
+from random import Random
+from statistics import mean, quantiles
+from time import perf_counter
+
+import openexchangerate
+
+
+CURRENCIES = dict(line.split(" ", 1) for line in """\
+AED United Arab Emirates Dirham
+AFN Afghan Afghani
+ALL Albanian Lek
+AMD Armenian Dram
+ANG Netherlands Antillean Guilder
+AOA Angolan Kwanza
+ARS Argentine Peso
+AUD Australian Dollar
+AWG Aruban Florin
+AZN Azerbaijani Manat
+BAM Bosnia-Herzegovina Convertible Mark
+BBD Barbadian Dollar
+BDT Bangladeshi Taka
+BGN Bulgarian Lev
+BHD Bahraini Dinar
+BIF Burundian Franc
+BMD Bermudan Dollar
+BND Brunei Dollar
+BOB Bolivian Boliviano
+BRL Brazilian Real
+BSD Bahamian Dollar
+BTC Bitcoin
+BTN Bhutanese Ngultrum
+BWP Botswanan Pula
+BYN Belarusian Ruble
+BZD Belize Dollar
+CAD Canadian Dollar
+CDF Congolese Franc
+CHF Swiss Franc
+CLF Chilean Unit of Account (UF)
+CLP Chilean Peso
+CNH Chinese Yuan (Offshore)
+CNY Chinese Yuan
+COP Colombian Peso
+CRC Costa Rican Colon
+CUC Cuban Convertible Peso
+CUP Cuban Peso
+CVE Cape Verdean Escudo
+CZK Czech Republic Koruna
+DJF Djiboutian Franc
+DKK Danish Krone
+DOP Dominican Peso
+DZD Algerian Dinar
+EGP Egyptian Pound
+ERN Eritrean Nakfa
+ETB Ethiopian Birr
+EUR Euro
+FJD Fijian Dollar
+FKP Falkland Islands Pound
+GBP British Pound Sterling
+GEL Georgian Lari
+GGP Guernsey Pound
+GHS Ghanaian Cedi
+GIP Gibraltar Pound
+GMD Gambian Dalasi
+GNF Guinean Franc
+GTQ Guatemalan Quetzal
+GYD Guyanaese Dollar
+HKD Hong Kong Dollar
+HNL Honduran Lempira
+HRK Croatian Kuna
+HTG Haitian Gourde
+HUF Hungarian Forint
+IDR Indonesian Rupiah
+ILS Israeli New Sheqel
+IMP Manx pound
+INR Indian Rupee
+IQD Iraqi Dinar
+IRR Iranian Rial
+ISK Icelandic Krona
+JEP Jersey Pound
+JMD Jamaican Dollar
+JOD Jordanian Dinar
+JPY Japanese Yen
+KES Kenyan Shilling
+KGS Kyrgystani Som
+KHR Cambodian Riel
+KMF Comorian Franc
+KPW North Korean Won
+KRW South Korean Won
+KWD Kuwaiti Dinar
+KYD Cayman Islands Dollar
+KZT Kazakhstani Tenge
+LAK Laotian Kip
+LBP Lebanese Pound
+LKR Sri Lankan Rupee
+LRD Liberian Dollar
+LSL Lesotho Loti
+LYD Libyan Dinar
+MAD Moroccan Dirham
+MDL Moldovan Leu
+MGA Malagasy Ariary
+MKD Macedonian Denar
+MMK Myanma Kyat
+MNT Mongolian Tugrik
+MOP Macanese Pataca
+MRU Mauritanian Ouguiya
+MUR Mauritian Rupee
+MVR Maldivian Rufiyaa
+MWK Malawian Kwacha
+MXN Mexican Peso
+MYR Malaysian Ringgit
+MZN Mozambican Metical
+NAD Namibian Dollar
+NGN Nigerian Naira
+NIO Nicaraguan Cordoba
+NOK Norwegian Krone
+NPR Nepalese Rupee
+NZD New Zealand Dollar
+OMR Omani Rial
+PAB Panamanian Balboa
+PEN Peruvian Nuevo Sol
+PGK Papua New Guinean Kina
+PHP Philippine Peso
+PKR Pakistani Rupee
+PLN Polish Zloty
+PYG Paraguayan Guarani
+QAR Qatari Rial
+RON Romanian Leu
+RSD Serbian Dinar
+RUB Russian Ruble
+RWF Rwandan Franc
+SAR Saudi Riyal
+SBD Solomon Islands Dollar
+SCR Seychellois Rupee
+SDG Sudanese Pound
+SEK Swedish Krona
+SGD Singapore Dollar
+SHP Saint Helena Pound
+SLL Sierra Leonean Leone
+SOS Somali Shilling
+SRD Surinamese Dollar
+SSP South Sudanese Pound
+STD Sao Tome and Principe Dobra (pre-2018)
+STN Sao Tome and Principe Dobra
+SVC Salvadoran Colon
+SYP Syrian Pound
+SZL Swazi Lilangeni
+THB Thai Baht
+TJS Tajikistani Somoni
+TMT Turkmenistani Manat
+TND Tunisian Dinar
+TOP Tongan Pa'anga
+TRY Turkish Lira
+TTD Trinidad and Tobago Dollar
+TWD New Taiwan Dollar
+TZS Tanzanian Shilling
+UAH Ukrainian Hryvnia
+UGX Ugandan Shilling
+USD United States Dollar
+UYU Uruguayan Peso
+UZS Uzbekistan Som
+VEF Venezuelan Bolivar Fuerte (Old)
+VES Venezuelan Bolivar Soberano
+VND Vietnamese Dong
+VUV Vanuatu Vatu
+WST Samoan Tala
+XAF CFA Franc BEAC
+XAG Silver Ounce
+XAU Gold Ounce
+XCD East Caribbean Dollar
+XDR Special Drawing Rights
+XOF CFA Franc BCEAO
+XPD Palladium Ounce
+XPF CFP Franc
+XPT Platinum Ounce
+YER Yemeni Rial
+ZAR South African Rand
+ZMW Zambian Kwacha
+ZWL Zimbabwean Dollar""".splitlines())
+CODES = tuple(CURRENCIES)
+
+_random = Random(42)
+FIXTURE_LATEST = dumps({
+    "disclaimer": "Usage subject to terms: https://openexchangerates.org/terms",
+    "license": "https://openexchangerates.org/license",
+    "timestamp": 1539590400, "base": "USD",
+    "rates": {code: 1 if code == "USD" else round(
+        10 ** _random.uniform(-5, 4), _random.randint(2, 8))
+        for code in CODES}}).encode()
+FIXTURE_CURRENCIES = dumps(CURRENCIES).encode()
+MODES = (("rounded_float", {}), ("float", {"round_float": False}),
+         ("decimal", {"use_float": False}))
+
+
+ARCHIVE = openexchangerate.RateArchive({
+    "USD/latest.json": FIXTURE_LATEST,
+    "USD/currencies.json": FIXTURE_CURRENCIES,
+    "USD/historical/2018-01-01.json": FIXTURE_LATEST})
+
+
+def _old_decode(client, response):
+    """Decode path before the fast decoder, kept to compare against."""
+    data = loads(response, parse_int=client.tipe,
+                 parse_float=client.tipe)['rates']
+    return data, namedtuple("OpenExchangeRates", data.keys())(*data.values())
+
+
+def _new_decode(client, response):
+    rates = client._parsed_response(response)
+    return rates.dict, rates.namedtuple
+
+
+def _per_call(function, number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=3)) / number
+
+
+def bench_decode(number: int=2000) -> dict:
+    """Old vs new decode of a full latest.json, per numeric mode."""
+    results = {}
+    for mode, kwargs in MODES:
+        client = openexchangerate.OpenExchangeRates("BENCH", **kwargs)
+        old, new = (_old_decode(client, FIXTURE_LATEST),
+                    _new_decode(client, FIXTURE_LATEST))
+        assert old[0] == new[0] and tuple(old[1]) == tuple(new[1])
+        assert all(type(a) is type(b)
+                   for a, b in zip(old[0].values(), new[0].values()))
+        for name, function in (("old", _old_decode), ("new", _new_decode)):
+            results[f"decode.{mode}.{name}"] = _per_call(
+                lambda: function(client, FIXTURE_LATEST), number)
+    return results
+
+
+def bench_endpoints(base_url: str, number: int=200) -> dict:
+    """Latency (mean, p50, p95) and throughput of the 3 endpoints."""
+    results = {}
+    for mode, kwargs in MODES:
+        client = openexchangerate.OpenExchangeRates(
+            "BENCH", base_url=base_url, **kwargs)
+        for endpoint, call in (("latest", client.latest),
+                               ("currencies", client.currencies),
+                               ("historical",
+                                lambda: client.historical("2018-01-01"))):
+            call()  # Warm up the connection pool.
+            latencies = []
+            for _ in range(number):
+                start = perf_counter()
+                call()
+                latencies.append(perf_counter() - start)
+            key = f"{endpoint}.{mode}"
+            results[f"{key}.mean"] = mean(latencies)
+            results[f"{key}.p50"], results[f"{key}.p95"] = (
+                quantiles(latencies, n=20)[9], quantiles(latencies, n=20)[18])
+            results[f"{key}.per_second"] = number / sum(latencies)
+        client.pool.close()
+    return results
+
+
+def bench_failures(number: int=200, error_rate: float=0.1,
+                   drop_rate: float=0.05) -> dict:
+    """latest() against a flaky, slow upstream, 1 to 5 ms of latency,
+    bare, with retries and with retries plus a circuit breaker."""
+    results = {}
+    for name, kwargs in (
+            ("bare", {}),
+            ("retry", {"retry": openexchangerate.Retry(backoff=0.001)}),
+            ("breaker", {"retry": openexchangerate.Retry(backoff=0.001),
+                         "breaker": openexchangerate.CircuitBreaker()})):
+        client = openexchangerate.OpenExchangeRates(
+            "BENCH", transport=openexchangerate.Replayer(
+                ARCHIVE, latency=(0.001, 0.005), error_rate=error_rate,
+                drop_rate=drop_rate, seed=42), **kwargs)
+        latencies, failures = [], 0
+        for _ in range(number):
+            start = perf_counter()
+            try:
+                client.latest()
+            except (OSError, ValueError):  # HTTPError, ConnectionError.
+                failures += 1
+            latencies.append(perf_counter() - start)
+        results[f"flaky.{name}.mean"] = mean(latencies)
+        results[f"flaky.{name}.p95"] = quantiles(latencies, n=20)[18]
+        results[f"flaky.{name}.failed"] = failures / number
+    return results
+
+
+def _old_html(client, prices_data_dict: dict, names_get):
+    """html() before the streaming renderer, kept to compare against."""
+    prices = tuple(enumerate(prices_data_dict.items()))
+    row = "<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td></tr>"
+    h = "<thead><th>#</th><th>Code</th><th>Price</th><th>Name</th></thead>"
+    rows = [row.format(index, mony[0], mony[1], names_get(mony[0], "???"))
+            for index, mony in prices if mony[0] not in ("EUR", "USD")]
+    prio = [row.format(index, mony[0], mony[1], names_get(mony[0], "???"))
+            for index, mony in prices if mony[0] in ("EUR", "USD")]
+    return (f"<table>{ h if client.html_table_header else ''}"
+            f"<tbody>{' '.join(prio + rows)}</tbody></table>")
+
+
+def bench_html(number: int=500) -> dict:
+    """Table rendering of full rates, currency names already fetched."""
+    names = loads(FIXTURE_CURRENCIES)
+    results = {}
+    for mode, kwargs in MODES:
+        client = openexchangerate.OpenExchangeRates("BENCH", **kwargs)
+        data = client._parsed_response(FIXTURE_LATEST).dict
+        assert client.html(data, names) == _old_html(client, data, names.get)
+        results[f"html.{mode}.old"] = _per_call(
+            lambda: _old_html(client, data, names.get), number)
+        results[f"html.{mode}.new"] = _per_call(
+            lambda: client.html(data, names), number)
+        for fmt in ("csv", "jsonl"):
+            results[f"{fmt}.{mode}"] = _per_call(
+                lambda: "".join(client.iter_table(data, fmt, names)), number)
+    return results
+
+
+def bench_local_conversion(number: int=2000) -> dict:
+    """local_base conversion of a full table, dict and RateTable view."""
+    results = {}
+    for mode, kwargs in MODES:
+        client = openexchangerate.OpenExchangeRates("BENCH", **kwargs)
+        data = client._parsed_response(FIXTURE_LATEST).dict
+        results[f"local_conversion.{mode}"] = _per_call(
+            lambda: client._local_conversion(data, "EUR"), number)
+        table = openexchangerate.RateTable.from_dict(data)
+        results[f"rebase.{mode}"] = _per_call(
+            lambda: table.rebase("EUR"), number)
+    return results
+
+
+def _pure_module():
+    """The pure Python module, even when the imported one is compiled."""
+    source = os.path.join(os.path.dirname(openexchangerate.__file__),
+                          "openexchangerate.py")
+    spec = importlib.util.spec_from_file_location("_pure", source)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_compiled(number: int=2000) -> dict:
+    """Pure Python vs compiled hot paths, rebase of a full table and
+    a batch conversion of 1000 amounts, both return identical results."""
+    data = loads(FIXTURE_LATEST)["rates"]
+    codes, rates = tuple(data), array('d', data.values())
+    amounts = array('d', (i / 7 for i in range(1000)))
+    nonzero = [i for i, rate in enumerate(rates) if rate]  # Some round to 0
+    srcs = array('q', (nonzero[i % len(nonzero)] for i in range(1000)))
+    dsts = array('q', (i * 7 % len(codes) for i in range(1000)))
+    results = {}
+    for name, module in (("pure", _pure_module()),
+                         ("compiled", openexchangerate)):
+        results[f"rebased.{name}"] = _per_call(
+            lambda: module._rebased_floats(codes, rates, 0.9, 6), number)
+        results[f"convert_many.{name}"] = _per_call(
+            lambda: module._converted_floats(amounts, rates, srcs, dsts),
+            number)
+    return results
+
+
+def bench_memory(count: int=100) -> dict:
+    """Bytes allocated per result, bare and with all fields read."""
+    results = {}
+    for mode, kwargs in MODES:
+        client = openexchangerate.OpenExchangeRates("BENCH", **kwargs)
+        for name, read in (("bare", ()),
+                           ("full", ("dict", "frozendict", "namedtuple",
+                                     "table"))):
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            results_kept = []
+            for _ in range(count):
+                rates = client._parsed_response(FIXTURE_LATEST)
+                for field in read:
+                    getattr(rates, field)
+                results_kept.append(rates)
+            after = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            results[f"memory.{mode}.{name}"] = (after - before) / count
+    return results
+
+
+def bench_import(number: int=10) -> dict:
+    """Import time of the module, minus the bare interpreter start up."""
+    def run(code):
+        start = perf_counter()
+        subprocess.run((sys.executable, "-c", code), check=True)
+        return perf_counter() - start
+    bare = min(run("pass") for _ in range(number))
+    module = min(run("import openexchangerate") for _ in range(number))
+    return {"import": module - bare}
+
+
+def run_all(number: int=200) -> dict:
+    with openexchangerate.Replayer(ARCHIVE).serve() as server:
+        results = bench_endpoints(server.url, number)
+    results.update(bench_failures(number))
+    for bench in (bench_decode, bench_html, bench_local_conversion,
+                  bench_compiled):
+        results.update(bench(number * 5))
+    results.update(bench_memory())
+    results.update(bench_import())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=200,
+                        help="Requests per endpoint and mode.")
+    parser.add_argument("--json", metavar="PATH",
+                        help="Write the results as JSON, to compare releases.")
+    args = parser.parse_args()
+    results = run_all(args.number)
+    for name, value in results.items():
+        unit = ("bytes" if name.startswith("memory.") else "/s"
+                if name.endswith(".per_second") else "ratio"
+                if name.endswith(".failed") else "us")
+        value = value if unit != "us" else value * 1e6
+        print(f"{name:<36} {value:12.2f} {unit}")
+    if args.json:
+        with open(args.json, "w") as stream:
+            dump({"version": openexchangerate.__version__,
+                  "python": platform.python_version(),
+                  "json": getattr(openexchangerate._fast_loads, "__module__",
+                                  "json"),
+                  "compiled": openexchangerate.COMPILED,
+                  "currencies": len(CODES), "results": results},
+                 stream, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,25 @@
-# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+# cython: language_level=3
 #
-# CYTHONIZE: cython -3 --verbose --no-docstrings --annotate python_module.py
-# COMPILE: gcc -shared -fPIC -I /usr/include/python3.6 -o python_module.so python_module.c
-
-
-cdef:
-    char* __version__
-    char* __license__
-    char* __author__
-    char* __email__
-    char* __contact__
-    char* __maintainer__
-    char* __url__
-    tuple __all__
-
-
-cdef class OpenExchangeRates:
+# Typed declarations for compiling openexchangerate.py with Cython,
+# the .py stays the source of truth and the pure Python fallback.
+#
+# CYTHONIZE: cythonize -3 --inplace openexchangerate.py
+# Or: pip install cython && pip install .
+#
+# No boundscheck/wraparound/cdivision overrides, compiled results and
+# errors (IndexError, ZeroDivisionError) must match pure Python exactly.
 
-    cdef public str api_key, base, local_base
-    cdef public object tipe
 
-    cdef _parsed_response(self, char response)
+cimport cython
 
-    cdef inline _local_conversion(self, dict data, char local_base)
-        # pass
 
-    cdef latest(self)
-        # pass
+@cython.locals(index=Py_ssize_t, value=double)
+cpdef dict _rebased_floats(tuple codes, const double[:] rates, double base,
+                           object ndigits)
 
-    cdef currencies(self)
-        # pass
 
-    cdef inline historical(self, object since_date)
-        # pass
+@cython.locals(index=Py_ssize_t, converted="double[::1]")
+cpdef object _converted_floats(const double[:] amounts,
+                               const double[:] rates,
+                               const long long[:] srcs,
+                               const long long[:] dsts)
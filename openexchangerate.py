@@ -8,16 +8,54 @@ Get your API Key for Free at https://openexchangerates.org/account/app-ids."""
 
 
 import decimal
-from collections import namedtuple
-from datetime import datetime
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from base64 import b64encode
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import Mapping
+from datetime import date, datetime, timedelta
+from email.parser import Parser
+from functools import lru_cache
+from http.client import (BadStatusLine, HTTPConnection, HTTPException,
+                         HTTPMessage, HTTPSConnection, IncompleteRead,
+                         RemoteDisconnected)
+from io import TextIOBase
+from itertools import islice, starmap
 from json import dumps, loads  # uJSON dont support parse_int, parse_float args
+from math import isclose
+from random import Random
+from sys import intern
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter, sleep, time
+from types import FunctionType
 from types import MappingProxyType as frozendict
-from urllib.parse import urlencode
-from urllib.request import urlopen
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+from urllib.request import getproxies, proxy_bypass
+from weakref import finalize
+
+
+try:
+    import fcntl
+except ImportError:  # MS Windows, the budget is shared by threads only.
+    fcntl = None
+
+try:  # Parses floats exactly like json, uJSON does not, so is not used.
+    from orjson import loads as _fast_loads
+except ImportError:
+    _fast_loads = None
 
 
 __version__ = "1.5.5"
-__all__ = ("OpenExchangeRatesClient", )
+__all__ = ("OpenExchangeRates", "AsyncOpenExchangeRates", "Rates",
+           "RateTable", "ResponseCache", "ConnectionPool", "RateSeries",
+           "SnapshotStore", "SingleFlight", "Metrics", "RequestBudget",
+           "BudgetExceeded", "RateArchive", "Recorder", "Replayer", "Retry",
+           "CircuitBreaker", "CircuitOpen")
 
 
 class _RoundedFloat(float):
@@ -31,109 +69,2262 @@ class _RoundedFloat(float):
         return value
 
 
+@lru_cache(maxsize=None)
+class _LazyModule(object):
+
+    """Module imported on first attribute use, for the slow to import ones.
+
+    Sync users never pay for asyncio nor concurrent.futures and logging."""
+
+    __slots__ = ("_name", )
+
+    def __init__(self, name: str):
+        self._name: str = name
+
+    def __getattr__(self, attr: str):
+        module = sys.modules.get(self._name)
+        if module is None:
+            __import__(self._name)
+            module = sys.modules[self._name]
+        return getattr(module, attr)
+
+
+asyncio = _LazyModule("asyncio")
+futures = _LazyModule("concurrent.futures")
+
+
+def _numpy():
+    """NumPy if installed, imported on first use as it is slow to import."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _rebased_floats(codes: tuple, rates, base: float, ndigits) -> dict:
+    """{code: rate / base} of float64 rates, rounded if ndigits, hot path."""
+    result = {}
+    for index in range(len(codes)):
+        value = rates[index] / base
+        result[codes[index]] = value if ndigits is None else round(
+            value, ndigits)
+    return result
+
+
+def _converted_floats(amounts, rates, srcs, dsts) -> array:
+    """amount * rates[dst] / rates[src] of float64 buffers, hot path."""
+    result = array('d', bytes(8 * len(amounts)))
+    converted = memoryview(result)
+    for index in range(len(amounts)):
+        converted[index] = (amounts[index] * rates[dsts[index]] /
+                            rates[srcs[index]])
+    return result
+
+
+COMPILED = not isinstance(_rebased_floats, FunctionType)  # By Cython.
+
+
+@lru_cache(maxsize=64)
+def _code_index(codes: tuple) -> tuple:
+    """Interned codes and code -> index map, shared by all same tables."""
+    codes = tuple(map(intern, codes))
+    return codes, {code: i for i, code in enumerate(codes)}
+
+
+def _restored_table(codes: tuple, rates, base: int=None):
+    """Unpickles a RateTable, float64 rates are a zero copy view."""
+    if not isinstance(rates, tuple):
+        rates = memoryview(rates).cast('B').cast('d')
+    return RateTable(codes, rates, base)
+
+
+def _attached_table(name: str, codes: tuple, base: int=None):
+    """Unpickles a shared RateTable, attaching to its shared memory."""
+    return RateTable.attach(name, codes, base)
+
+
+def _detached(rates, memory):
+    """Finalizer of shared RateTables, releases rates before the mapping."""
+    try:
+        rates.release()
+    except BufferError:  # Still exported, by a NumPy array say, leave it.
+        return
+    memory.close()
+
+
+@lru_cache(maxsize=64)
+def _namedtuple_class(fields: tuple):
+    """Same currencies on every response, so reuse the namedtuple class."""
+    return namedtuple("OpenExchangeRates", fields)
+
+
+class RateTable(Mapping):
+
+    """Rates of one response as a code -> index map and a contiguous array.
+
+    Converts any to any currency, rebase() is a cheap view sharing the same
+    array. Floats are stored in an array('d') or a float64 memoryview,
+    Decimals in a tuple. The code index is interned and shared by tables.
+
+    Pickles compactly, with protocol 5 the float64 buffer goes out-of-band.
+    share() copies it into shared memory, those pickle as just its name."""
+
+    __slots__ = ("codes", "index", "rates", "base", "_memory", "_owner",
+                 "_parent", "_finalizer", "__weakref__")
+
+    def __init__(self, codes, rates, base: int=None, index=None):
+        if not index:
+            codes, index = _code_index(tuple(codes))
+        self.codes: tuple = tuple(codes)
+        self.index: dict = index
+        self.rates = rates
+        self.base: int = base  # Index of the local base, None for as-is.
+        self._memory = None  # SharedMemory holding the rates, if shared.
+        self._owner: bool = False  # Made by share(), unlinks on close().
+        self._parent = None  # Shared table a rebase() view keeps alive.
+        self._finalizer = None  # Detaches from the memory when collected.
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        rates = tuple(data.values())
+        if not rates or not isinstance(rates[0], decimal.Decimal):
+            rates = array('d', rates)
+        return cls(data.keys(), rates)
+
+    def rebase(self, local_base: str):
+        """Same rates with local_base worth 1, without copying them."""
+        table = self.__class__(self.codes, self.rates,
+                               self.index[local_base], self.index)
+        if self._memory is not None:
+            table._memory, table._parent = self._memory, self._parent or self
+        return table
+
+    @property
+    def dict(self) -> dict:
+        return self.to_dict()
+
+    @property
+    def frozendict(self):
+        return frozendict(self.to_dict())
+
+    def moved(self, reference: dict, rel_tol: float=0.0,
+              abs_tol: float=0.0) -> dict:
+        """{code: rate} of rates not math.isclose() to the reference ones.
+
+        Rates missing from the reference are included too."""
+        return {code: rate for code, rate in self.to_dict().items()
+                if code not in reference or not isclose(
+                    rate, reference[code], rel_tol=rel_tol, abs_tol=abs_tol)}
+
+    def share(self):
+        """Copy of the float64 rates in multiprocessing.shared_memory.
+
+        Pickles as the shared memory name, workers attach with zero copy.
+        The returned table owns the memory, close() it to free it."""
+        from multiprocessing.shared_memory import SharedMemory
+        if isinstance(self.rates, tuple):
+            raise TypeError("Only float rates can be shared, not Decimal.")
+        memory = SharedMemory(create=True, size=max(8 * len(self.rates), 1))
+        rates = memory.buf[:8 * len(self.rates)].cast('d')
+        rates[:] = memoryview(self.rates)
+        table = self.__class__(self.codes, rates, self.base, self.index)
+        return table._mapped(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, codes: tuple, base: int=None):
+        """Table over the shared memory name made by share(), zero copy."""
+        from multiprocessing.shared_memory import SharedMemory
+        try:  # Python 3.13+, the creator is the one to unlink it.
+            memory = SharedMemory(name=name, track=False)
+        except TypeError:
+            memory = SharedMemory(name=name)
+        table = cls(codes, memory.buf[:8 * len(codes)].cast('d'), base)
+        return table._mapped(memory)
+
+    def _mapped(self, memory, owner: bool=False):
+        self._memory, self._owner = memory, owner
+        self._finalizer = finalize(self, _detached, self.rates, memory)
+        return self
+
+    def close(self):
+        """Detaches from the shared memory, unlinks it if made by share().
+
+        Tables rebased from this one must not be used after closing it."""
+        if self._finalizer is not None:
+            self.rates.release()
+            self._finalizer()
+            if self._owner:
+                self._memory.unlink()
+            self._memory = self._finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def __reduce_ex__(self, protocol: int):
+        if self._memory is not None:
+            return _attached_table, (self._memory.name, self.codes, self.base)
+        if isinstance(self.rates, tuple):
+            return _restored_table, (self.codes, self.rates, self.base)
+        if protocol >= 5:
+            from pickle import PickleBuffer
+            return _restored_table, (self.codes, PickleBuffer(self.rates),
+                                     self.base)
+        return _restored_table, (self.codes, bytes(self.rates), self.base)
+
+    def to_dict(self, ndigits: int=None) -> dict:
+        if self.base is None and ndigits is None:
+            return dict(zip(self.codes, self.rates))
+        base = 1 if self.base is None else self.rates[self.base]
+        if not isinstance(self.rates, tuple):
+            return _rebased_floats(self.codes, self.rates, base, ndigits)
+        if ndigits is None:
+            return {code: rate / base
+                    for code, rate in zip(self.codes, self.rates)}
+        return {code: round(rate / base, ndigits)
+                for code, rate in zip(self.codes, self.rates)}
+
+    def _amount(self, amount):
+        if not isinstance(self.rates, tuple) or isinstance(
+                amount, (int, decimal.Decimal)):
+            return amount
+        return decimal.Decimal(str(amount))
+
+    def convert(self, amount, src: str, dst: str):
+        """Converts amount of src currency into dst currency."""
+        rates, index = self.rates, self.index
+        return self._amount(amount) * rates[index[dst]] / rates[index[src]]
+
+    def _numpy_indices(self, codes, numpy):
+        if isinstance(codes, str):
+            return self.index[codes]
+        codes = numpy.asarray(codes)
+        if codes.dtype.kind in "iu":  # Already indices into self.codes.
+            return codes
+        uniques, inverse = numpy.unique(codes, return_inverse=True)
+        return numpy.array([self.index[c] for c in uniques.tolist()],
+                           dtype=numpy.intp)[inverse]
+
+    def _indices(self, codes, size: int) -> array:
+        """Codes, indices or one code as an array('q') of indices."""
+        if isinstance(codes, str):
+            return array('q', [self.index[codes]]) * size
+        if isinstance(codes, array) and codes.typecode == 'q':
+            return codes
+        if isinstance(codes, (array, memoryview)):  # Already indices.
+            return array('q', codes)
+        index = self.index
+        return array('q', [code if isinstance(code, int) else index[code]
+                           for code in codes])
+
+    def convert_many(self, amounts, srcs, dsts):
+        """Converts a batch, srcs and dsts are codes, indices or one code.
+
+        Uses NumPy arrays when installed, else returns an array('d'),
+        for Decimal rates returns a list of Decimal."""
+        rates, numpy = self.rates, _numpy()
+        if numpy is not None and not isinstance(rates, tuple):
+            rates = numpy.frombuffer(rates, dtype=numpy.float64)
+            return (numpy.asarray(amounts, dtype=numpy.float64) *
+                    rates[self._numpy_indices(dsts, numpy)] /
+                    rates[self._numpy_indices(srcs, numpy)])
+        if not isinstance(rates, tuple):
+            if not isinstance(amounts, array) or amounts.typecode != 'd':
+                amounts = array('d', amounts)
+            return _converted_floats(amounts, rates,
+                                     self._indices(srcs, len(amounts)),
+                                     self._indices(dsts, len(amounts)))
+        amounts = amounts if hasattr(amounts, "__len__") else list(amounts)
+        return [self._amount(amount) * rates[dst] / rates[src]
+                for amount, src, dst in zip(
+                    amounts, self._indices(srcs, len(amounts)),
+                    self._indices(dsts, len(amounts)))]
+
+    def __getitem__(self, code: str):
+        rate = self.rates[self.index[code]]
+        return rate if self.base is None else rate / self.rates[self.base]
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def __iter__(self):
+        return iter(self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        base = "" if self.base is None else f", base={self.codes[self.base]}"
+        return f"{self.__class__.__name__}({len(self.codes)} rates{base})"
+
+
+class Rates(object):
+
+    """Lazy API result, .frozendict, .namedtuple, .html are built on 1st read.
+
+    .html needs the currency names, so only reading it fetches currencies().
+    .table is a RateTable, local_base is applied as a view of it."""
+
+    __slots__ = ("raw", "local_base", "stale", "_client", "_dict", "_table",
+                 "_frozendict", "_namedtuple", "_html")
+    _fields = ("dict", "frozendict", "html", "namedtuple")
+
+    def __init__(self, data: dict, client=None, local_base: str=None):
+        self.raw: dict = data  # As returned by the API, before local_base.
+        self.local_base: str = local_base
+        self.stale: bool = False  # Last good rates of the circuit breaker.
+        self._client = client  # Renders the HTML, None for currencies().
+        self._dict = self._table = None
+        self._frozendict = self._namedtuple = self._html = None
+
+    @property
+    def dict(self):
+        if self._dict is None:
+            self._dict = (self.table.to_dict(8) if self.local_base
+                          else self.raw)
+        return self._dict
+
+    @property
+    def table(self):
+        if self._table is None:
+            table = RateTable.from_dict(self.raw)
+            self._table = (table.rebase(self.local_base) if self.local_base
+                           else table)
+        return self._table
+
+    @property
+    def frozendict(self):
+        if self._frozendict is None:
+            self._frozendict = frozendict(self.dict)
+        return self._frozendict
+
+    @property
+    def namedtuple(self):
+        if self._namedtuple is None:
+            self._namedtuple = _namedtuple_class(tuple(self.dict))(
+                *self.dict.values())
+        return self._namedtuple
+
+    @property
+    def html(self):
+        if self._client is None:
+            raise AttributeError("html needs exchange rates from a sync "
+                                 "client, use client.html(rates.dict)")
+        if self._html is None:
+            self._html = self._client.html(self.dict)
+        return self._html
+
+    def __iter__(self):  # Unpacking like the old namedtuple results.
+        return (getattr(self, field) for field in self._fields
+                if field != "html" or self._client is not None)
+
+    def __reduce__(self):  # Only the API data, without client nor caches.
+        return self.__class__, (self.raw, None, self.local_base)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.dict!r})"
+
+
+class ResponseCache(object):
+
+    """LRU cache of raw API responses with per endpoint TTL in seconds.
+
+    Expired entries are revalidated with If-None-Match / If-Modified-Since,
+    an unchanged payload comes back as a cheap 304. TTL None never expires."""
+
+    __slots__ = ("maxsize", "ttl", "hits", "misses", "revalidations",
+                 "_entries", "_lock")
+    TTL = {"latest": 3600, "currencies": 86400, "historical": None}
+
+    def __init__(self, maxsize: int=256, ttl: dict=None):
+        self.maxsize: int = int(maxsize)
+        self.ttl: dict = dict(self.TTL, **(ttl or {}))
+        self.hits = self.misses = self.revalidations = 0
+        self._entries = OrderedDict()  # url: [expires, etag, modified, body]
+        self._lock = Lock()
+
+    def _expires(self, endpoint: str):
+        ttl = self.ttl.get(endpoint)
+        return None if ttl is None else monotonic() + ttl
+
+    def lookup(self, url: str):
+        """Returns (body, None) if fresh, else (None, conditional headers)."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                self.misses += 1
+                return None, {}
+            self._entries.move_to_end(url)
+            if entry[0] is None or entry[0] > monotonic():
+                self.hits += 1
+                return entry[3], None
+            self.misses += 1
+            headers = {}
+            if entry[1]:
+                headers["If-None-Match"] = entry[1]
+            if entry[2]:
+                headers["If-Modified-Since"] = entry[2]
+            return None, headers
+
+    def store(self, url: str, endpoint: str, headers, body: bytes):
+        with self._lock:
+            self._entries[url] = [self._expires(endpoint), headers.get("ETag"),
+                                  headers.get("Last-Modified"), body]
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def revalidated(self, url: str, endpoint: str):
+        """Server said 304 Not Modified, renew the entry and return body."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:  # Evicted while the request was in flight.
+                return None
+            self.revalidations += 1
+            entry[0] = self._expires(endpoint)
+            return entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.revalidations = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size":
+                len(self._entries), "revalidations": self.revalidations}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(maxsize={self.maxsize}, "
+                f"stats={self.stats()})")
+
+
+class ConnectionPool(object):
+
+    """Thread-safe pool of keep-alive HTTP(S) connections to a single host.
+
+    Saves the TCP and TLS handshakes on every request, idle connections older
+    than idle_timeout are dropped, closed connections reconnect cleanly.
+    connect_timeout bounds DNS, TCP and TLS, timeout every read after it.
+
+    Goes through the HTTP_PROXY or HTTPS_PROXY of the environment unless
+    NO_PROXY matches, like urlopen(), HTTPS with a CONNECT tunnel.
+    Redirects are not followed, a 3xx status is returned as is."""
+
+    __slots__ = ("scheme", "host", "port", "timeout", "maxsize",
+                 "idle_timeout", "connect_timeout", "proxy", "created",
+                 "reused", "_proxy_headers", "_idle", "_lock")
+
+    def __init__(self, url: str, timeout: float=60, maxsize: int=4,
+                 idle_timeout: int=30, connect_timeout: float=None):
+        parts = urlsplit(url)
+        self.scheme: str = parts.scheme
+        self.host: str = parts.hostname
+        self.port: int = parts.port
+        self.timeout: float = timeout
+        self.connect_timeout: float = (timeout if connect_timeout is None
+                                       else connect_timeout)
+        self.maxsize: int = int(maxsize)
+        self.idle_timeout: int = idle_timeout
+        proxy = getproxies().get(self.scheme)
+        if proxy and "://" not in proxy:  # "host:port", like urlopen().
+            proxy = f"http://{proxy}"
+        self.proxy: str = (None if not proxy or proxy_bypass(parts.netloc)
+                           else proxy)
+        self._proxy_headers = _proxy_headers(self.proxy)
+        self.created = self.reused = 0
+        self._idle = []  # LIFO of (connection, last used), warmest on top.
+        self._lock = Lock()
+
+    def _get(self):
+        """Returns (connection, reused), reusing an idle one if possible."""
+        with self._lock:
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                if monotonic() - last_used < self.idle_timeout:
+                    self.reused += 1
+                    return connection, True
+                connection.close()
+            self.created += 1
+        kind = HTTPSConnection if self.scheme == "https" else HTTPConnection
+        if self.proxy is None:
+            return kind(self.host, self.port,
+                        timeout=self.connect_timeout), False
+        proxy = urlsplit(self.proxy)
+        connection = kind(proxy.hostname, proxy.port or 80,
+                          timeout=self.connect_timeout)
+        if self.scheme == "https":  # TLS end to end inside the tunnel.
+            connection.set_tunnel(self.host, self.port, self._proxy_headers)
+        return connection, False
+
+    def _put(self, connection):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((connection, monotonic()))
+                return
+        connection.close()
+
+    @staticmethod
+    def _timed_connect(connection, timings: dict):
+        """Connects, timing DNS + TCP as connect and the rest as tls."""
+        create = connection._create_connection
+
+        def timed_create(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return create(*args, **kwargs)
+            finally:
+                timings["connect"] = perf_counter() - start
+
+        connection._create_connection = timed_create
+        start = perf_counter()
+        connection.connect()
+        if isinstance(connection, HTTPSConnection):
+            timings["tls"] = perf_counter() - start - timings["connect"]
+
+    def request(self, url: str, headers: dict=None, timings: dict=None):
+        """GET the url, returns (status, headers, body).
+
+        If timings is a dict, phase durations in seconds are added to it."""
+        parts = urlsplit(url)
+        path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+        if self.proxy is not None and self.scheme == "http":
+            path = url  # Plain HTTP proxies take the absolute URL.
+            headers = {**self._proxy_headers, **(headers or {})}
+        connection, reused = self._get()
+        try:
+            if connection.sock is None:
+                if timings is not None:
+                    self._timed_connect(connection, timings)
+                else:
+                    connection.connect()
+                connection.sock.settimeout(self.timeout)
+            start = perf_counter()
+            connection.request("GET", path, headers=headers or {})
+            response = connection.getresponse()
+            body = response.read()
+            if timings is not None:
+                timings["transfer"] = perf_counter() - start
+        except (ConnectionError, HTTPException):
+            connection.close()
+            if reused:  # Server closed the idle keep-alive, try a new one.
+                return self.request(url, headers, timings)
+            raise
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._put(connection)
+        return response.status, response.headers, body
+
+    async def arequest(self, url: str, headers: dict=None,
+                       timings: dict=None):
+        """Async GET like request(), on a new connection per request."""
+        return await _async_request(url, headers, timings,
+                                    self.connect_timeout)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            connection.close()
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}({self.scheme}://{self.host}, "
+                f"maxsize={self.maxsize}, created={self.created}, "
+                f"reused={self.reused})")
+
+
+def _proxy_headers(proxy: str=None) -> dict:
+    """Proxy-Authorization for the user:password@ of the proxy URL, if any."""
+    parts = urlsplit(proxy or "")
+    if parts.username is None:
+        return {}
+    credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+    return {"Proxy-Authorization":
+            "Basic " + b64encode(credentials.encode()).decode("ascii")}
+
+
+def _day(since_date) -> date:
+    """date, datetime or "YYYY-MM-DD" string to date."""
+    if isinstance(since_date, datetime):
+        return since_date.date()
+    if isinstance(since_date, date):
+        return since_date
+    return datetime.strptime(str(since_date), r'%Y-%m-%d').date()
+
+
+def _failed(status: int) -> bool:
+    """HTTP 429 and 5xx mean upstream is unhealthy, worth a retry."""
+    return status == 429 or status >= 500
+
+
+class _StaleBody(bytes):
+    """Last good body served by the circuit breaker, never cached."""
+
+
+def _transient(error: Exception) -> bool:
+    """Network errors, timeouts, HTTP 429 and 5xx are worth a retry."""
+    if isinstance(error, HTTPError):
+        return _failed(error.code)
+    if isinstance(error, CircuitOpen):  # Fails fast on purpose.
+        return False
+    if isinstance(error, (OSError, HTTPException)):
+        return True
+    loaded = sys.modules.get("asyncio")  # Only async clients time out so.
+    return loaded is not None and isinstance(error, loaded.TimeoutError)
+
+
+class RateSeries(object):
+
+    """Dates x currencies table of rates, one array('d') column per currency.
+
+    series.by_date(day) -> dict, series.by_currency("EUR") -> array('d'),
+    series[day, "EUR"] -> float. Missing values are NaN."""
+
+    __slots__ = ("dates", "codes", "columns", "_rows")
+
+    def __init__(self, dates, rates: list):
+        self.dates: tuple = tuple(map(_day, dates))
+        self.codes: tuple = tuple(sorted(set().union(*rates)))
+        nan = float("nan")
+        self.columns: dict = {
+            code: array('d', [float(rate.get(code, nan)) for rate in rates])
+            for code in self.codes}
+        self._rows = {day: row for row, day in enumerate(self.dates)}
+
+    def by_date(self, since_date) -> dict:
+        row = self._rows[_day(since_date)]
+        return {code: column[row] for code, column in self.columns.items()}
+
+    def by_currency(self, code: str) -> array:
+        return self.columns[code]
+
+    def __getitem__(self, key):
+        since_date, code = key
+        return self.columns[code][self._rows[_day(since_date)]]
+
+    def __contains__(self, since_date):
+        return _day(since_date) in self._rows
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}({len(self.dates)} dates x "
+                f"{len(self.codes)} currencies)")
+
+
+class SnapshotStore(object):
+
+    """Append-only file of historical rates snapshots, read through mmap.
+
+    Fixed width records of (date, base, one float64 per currency column),
+    the columns are set by codes or by the first snapshot appended, other
+    currencies are not stored, missing ones are NaN. Several processes on
+    the same host can read and append to the same file."""
+
+    __slots__ = ("path", "codes", "_record", "_offsets", "_mmap", "_lock")
+    MAGIC = b"OXRS\x01\x00\x00\x00"
+
+    def __init__(self, path: str, codes: tuple=None):
+        self.path: str = os.fspath(path)
+        self.codes: tuple = None
+        self._record = None  # struct.Struct of one record.
+        self._offsets = {}   # (date ordinal, base): record offset.
+        self._mmap = None
+        self._lock = Lock()
+        if os.path.exists(self.path):
+            self._refresh()
+        elif codes:
+            self._create(codes)
+
+    def _create(self, codes):
+        codes = b"".join(code.encode("ascii").ljust(8, b"\0")[:8]
+                         for code in codes)
+        header = self.MAGIC + struct.pack("=q", len(codes) // 8) + codes
+        temp = f"{self.path}.{os.getpid()}.{id(header)}.tmp"
+        with open(temp, "wb") as stream:
+            stream.write(header)
+        try:  # Never seen half written, link fails if other process won.
+            os.link(temp, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp)
+        self._refresh()
+
+    def _refresh(self):
+        """Maps the file again if it grew, indexing the new records."""
+        with open(self.path, "rb") as stream:
+            size = os.fstat(stream.fileno()).st_size
+            if self._mmap is not None and size <= len(self._mmap):
+                return
+            mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:8] != self.MAGIC:
+            raise ValueError(f"{self.path} is not a SnapshotStore file.")
+        if self.codes is None:
+            count = struct.unpack_from("=q", mapped, 8)[0]
+            self.codes = tuple(
+                mapped[16 + 8 * i:24 + 8 * i].rstrip(b"\0").decode("ascii")
+                for i in range(count))
+            self._record = struct.Struct(f"=q8s{count}d")
+        start = 16 + 8 * len(self.codes)
+        offset = start + len(self._offsets) * self._record.size
+        while offset + self._record.size <= len(mapped):  # Whole ones only.
+            day, base = struct.unpack_from("=q8s", mapped, offset)
+            self._offsets[(day, base.rstrip(b"\0").decode("ascii"))] = offset
+            offset += self._record.size
+        self._mmap = mapped  # Old map closes when its last view is gone.
+
+    def _offset(self, since_date, base: str):
+        if self.codes is None:
+            if not os.path.exists(self.path):
+                return None
+            self._refresh()
+        key = (_day(since_date).toordinal(), base.upper())
+        with self._lock:
+            if key not in self._offsets:
+                self._refresh()
+            return self._offsets.get(key)
+
+    def get(self, since_date, base: str="USD"):
+        """Zero copy memoryview of float64 in codes order, or None."""
+        offset = self._offset(since_date, base)
+        if offset is None:
+            return None
+        start = offset + 16
+        return memoryview(self._mmap)[
+            start:start + 8 * len(self.codes)].cast("d")
+
+    def rates(self, since_date, base: str="USD", tipe=float):
+        """Dict of code: tipe(rate) for the date, or None if not stored.
+
+        Rates are stored as float64, so Decimal ones are lossy, they do not
+        keep the digits of the API, OpenExchangeRates skips the store then."""
+        values = self.get(since_date, base)
+        if values is None:
+            return None
+        if tipe is decimal.Decimal:
+            return {code: tipe(repr(value)) for code, value
+                    in zip(self.codes, values) if value == value}
+        return {code: tipe(value) for code, value
+                in zip(self.codes, values) if value == value}  # Skip NaN.
+
+    def append(self, since_date, base: str, rates: dict):
+        """Appends one snapshot, with a single atomic append write."""
+        if self.codes is None:
+            self._create(rates.keys())
+        if self._offset(since_date, base) is not None:
+            return
+        nan, get = float("nan"), rates.get
+        record = self._record.pack(
+            _day(since_date).toordinal(), base.upper().encode("ascii"),
+            *(float(get(code, nan)) for code in self.codes))
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND |
+                     getattr(os, "O_BINARY", 0))
+        try:
+            os.write(fd, record)
+        finally:
+            os.close(fd)
+
+    def __contains__(self, key):
+        """(date, base) in store, or date in store for USD base."""
+        since_date, base = key if isinstance(key, tuple) else (key, "USD")
+        return self._offset(since_date, base) is not None
+
+    def __len__(self):
+        if self.codes is not None:
+            self._refresh()
+        return len(self._offsets)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r}, {len(self)} dates)"
+
+
+class SingleFlight(object):
+
+    """Concurrent calls with the same key share one call and its result.
+
+    do() is for threads, ado() for asyncio, coalesced counts shared calls."""
+
+    __slots__ = ("coalesced", "_calls", "_tasks", "_lock")
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}  # key: [Event, result, exception] in flight.
+        self._tasks = {}  # key: asyncio.Task in flight.
+        self._lock = Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = [Event(), None, None]
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        try:
+            call[1] = function()
+            return call[1]
+        except BaseException as error:
+            call[2] = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+
+    async def ado(self, key, coroutine_function):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(
+                coroutine_function())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)  # A cancelled caller wont cancel.
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(in_flight="
+                f"{len(self._calls) + len(self._tasks)}, "
+                f"coalesced={self.coalesced})")
+
+
+class Metrics(object):
+
+    """Hook collecting counters and per phase histograms of client calls.
+
+    OpenExchangeRates(api_key, hooks=[metrics]), then export with as_dict()
+    or prometheus(). A hook is any callable taking the event dict:
+    {"endpoint", "status", "bytes", "cache", "error", "timings": {phase: s}}
+    phases are connect, tls, transfer, decode, convert, render, currencies
+    and total, only the ones that happened are present."""
+
+    __slots__ = ("prefix", "buckets", "counters", "histograms", "_lock")
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+               0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, prefix: str="openexchangerate", buckets: tuple=None):
+        self.prefix: str = prefix
+        self.buckets: tuple = tuple(buckets or self.BUCKETS)
+        self.counters = {}    # (name, labels): value
+        self.histograms = {}  # labels: [bucket counts..., sum, count]
+        self._lock = Lock()
+
+    def _count(self, name: str, labels: tuple, value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def __call__(self, event: dict):
+        endpoint = ("endpoint", event["endpoint"])
+        with self._lock:
+            self._count("requests_total", (endpoint, (
+                "status", str(event.get("status") or event.get("cache") or
+                              ("error" if event.get("error") else "")))))
+            self._count("bytes_total", (endpoint, ), event.get("bytes", 0))
+            if event.get("error") is not None:
+                self._count("errors_total", (endpoint, ("error", type(
+                    event["error"]).__name__)))
+            for phase, seconds in event["timings"].items():
+                labels = (endpoint, ("phase", phase))
+                histogram = self.histograms.get(labels)
+                if histogram is None:
+                    histogram = self.histograms[labels] = [0] * (
+                        len(self.buckets) + 2)
+                for index, bucket in enumerate(self.buckets):
+                    if seconds <= bucket:
+                        histogram[index] += 1
+                histogram[-2] += seconds
+                histogram[-1] += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {
+                    name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}":
+                    value for (name, labels), value in self.counters.items()},
+                "histograms": {
+                    "phase_seconds{" + ",".join(
+                        f"{k}={v}" for k, v in labels) + "}": {
+                        "buckets": dict(zip(self.buckets, histogram)),
+                        "sum": histogram[-2], "count": histogram[-1]}
+                    for labels, histogram in self.histograms.items()}}
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        def label(labels, *extra):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels + extra) + "}"
+
+        lines, typed = [], set()
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {self.prefix}_{name} counter")
+                lines.append(f"{self.prefix}_{name}{label(labels)} {value}")
+            name = f"{self.prefix}_phase_seconds"
+            if self.histograms:
+                lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in sorted(self.histograms.items()):
+                for bucket, count in zip(self.buckets, histogram):
+                    lines.append(f"{name}_bucket"
+                                 f"{label(labels, ('le', bucket))} {count}")
+                lines.append(f"{name}_bucket{label(labels, ('le', '+Inf'))} "
+                             f"{histogram[-1]}")
+                lines.append(f"{name}_sum{label(labels)} {histogram[-2]}")
+                lines.append(f"{name}_count{label(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+class BudgetExceeded(Exception):
+    """The request budget is spent, raised by RequestBudget policy fail."""
+
+
+class RequestBudget(object):
+
+    """Token bucket of limit requests per period seconds, by priority.
+
+    Live calls (latest, currencies) can use every token, backfill calls
+    (historical) only the tokens above reserve * limit. When out of tokens
+    policy "wait" sleeps until one refills (up to max_wait seconds) and
+    policy "fail" raises BudgetExceeded. With a path the bucket lives in
+    that file, so all the processes on the host share the same budget."""
+
+    __slots__ = ("limit", "period", "reserve", "policy", "max_wait", "path",
+                 "_state", "_lock")
+    PRIORITIES = {"latest": 0, "currencies": 0, "historical": 1}
+    _STATE = struct.Struct("=ddq")  # Tokens, time.time() updated, used.
+
+    def __init__(self, limit: int=1000, period: float=30 * 24 * 3600,
+                 reserve: float=0.2, policy: str="wait",
+                 max_wait: float=None, path: str=None):
+        if policy not in ("wait", "fail"):
+            raise ValueError("policy must be 'wait' or 'fail'.")
+        self.limit: int = int(limit)
+        self.period: float = float(period)
+        self.reserve: float = float(reserve)
+        self.policy: str = policy
+        self.max_wait: float = max_wait
+        self.path: str = None if path is None else os.fspath(path)
+        self._state = [float(self.limit), time(), 0]
+        self._lock = Lock()
+
+    def _update(self, function):
+        """Runs function on the [tokens, updated, used] state, locked."""
+        with self._lock:
+            if self.path is None:
+                return function(self._state)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT |
+                         getattr(os, "O_BINARY", 0))
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                data = os.read(fd, self._STATE.size)
+                state = (list(self._STATE.unpack(data)) if len(data) ==
+                         self._STATE.size else [float(self.limit), time(), 0])
+                result = function(state)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, self._STATE.pack(*state))
+                return result
+            finally:
+                os.close(fd)  # Releases the flock too.
+
+    def _refill(self, state) -> float:
+        now = time()
+        state[0] = min(self.limit, state[0] + max(0, now - state[1]) *
+                       self.limit / self.period)
+        state[1] = now
+        return state[0]
+
+    def _take(self, state, floor: float) -> float:
+        """Takes a token, returns 0 or the seconds until one is available."""
+        if self._refill(state) - 1 >= floor:
+            state[0] -= 1
+            state[2] += 1
+            return 0
+        return (floor + 1 - state[0]) * self.period / self.limit
+
+    def _wait(self, endpoint: str, waited: float) -> float:
+        floor = self.reserve * self.limit if self.PRIORITIES.get(
+            endpoint, 1) else 0
+        seconds = self._update(lambda state: self._take(state, floor))
+        if seconds and (self.policy == "fail" or floor + 1 > self.limit or
+                        self.max_wait is not None and
+                        waited + seconds > self.max_wait):
+            raise BudgetExceeded(f"No request budget left for {endpoint}, "
+                                 f"next in {seconds:.1f} seconds.")
+        return seconds
+
+    def acquire(self, endpoint: str):
+        """Takes 1 request from the budget for the endpoint."""
+        waited, seconds = 0, self._wait(endpoint, 0)
+        while seconds:
+            sleep(seconds)
+            waited += seconds
+            seconds = self._wait(endpoint, waited)
+
+    async def aacquire(self, endpoint: str):
+        """Takes 1 request from the budget for the endpoint, asyncio."""
+        waited, seconds = 0, self._wait(endpoint, 0)
+        while seconds:
+            await asyncio.sleep(seconds)
+            waited += seconds
+            seconds = self._wait(endpoint, waited)
+
+    @property
+    def remaining(self) -> float:
+        return self._update(self._refill)
+
+    @property
+    def used(self) -> int:
+        return self._update(lambda state: state[2])
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(limit={self.limit}, "
+                f"period={self.period}, remaining={self.remaining:.1f})")
+
+
+class Retry(object):
+
+    """Retries of the API calls, all idempotent GETs, and hedged requests.
+
+    Network errors, timeouts, HTTP 429 and 5xx are retried up to attempts
+    times in total, after a full jitter exponential backoff in seconds.
+    With hedge, a 2nd request is sent if the 1st is slower than hedge_after
+    seconds, or else than the p95 of the last 100 latencies, first wins."""
+
+    __slots__ = ("attempts", "backoff", "max_backoff", "hedge",
+                 "hedge_after", "retried", "hedged", "_latencies",
+                 "_random", "_executor")
+
+    def __init__(self, attempts: int=3, backoff: float=0.1,
+                 max_backoff: float=10.0, hedge: bool=False,
+                 hedge_after: float=None, seed: int=None):
+        self.attempts: int = max(int(attempts), 1)
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self.hedge: bool = hedge
+        self.hedge_after: float = hedge_after
+        self.retried = self.hedged = 0
+        self._latencies = deque(maxlen=100)
+        self._random = Random(seed)
+        self._executor = None  # Runs sync hedged requests, made on 1st use.
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retrying after the attempt, 0 based."""
+        return self._random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def observe(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def hedge_delay(self) -> float:
+        """Seconds before hedging, None without hedge or 20 latencies yet."""
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        latencies = sorted(self._latencies)
+        return latencies[int(len(latencies) * 0.95)] if len(
+            latencies) >= 20 else None
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = futures.ThreadPoolExecutor(
+                8, "openexchangerate-hedge")
+        return self._executor
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(attempts={self.attempts}, "
+                f"hedge={self.hedge}, retried={self.retried}, "
+                f"hedged={self.hedged})")
+
+
+class CircuitOpen(ConnectionError):
+    """Upstream is unhealthy and there is no last good response to serve."""
+
+
+class CircuitBreaker(object):
+
+    """Fails fast while upstream is unhealthy, instead of waiting timeouts.
+
+    Opens after failures consecutive failed requests, then every reset
+    seconds lets 1 trial request through and closes if it succeeds.
+    While open, or after the last retry failed, with stale the client
+    serves the last good response of the url if any, else CircuitOpen."""
+
+    __slots__ = ("failures", "reset", "stale", "maxsize", "state", "opened",
+                 "served_stale", "_count", "_opened_at", "_good", "_lock")
+
+    def __init__(self, failures: int=5, reset: float=30.0,
+                 stale: bool=True, maxsize: int=64):
+        self.failures: int = max(int(failures), 1)
+        self.reset: float = reset
+        self.stale: bool = stale
+        self.maxsize: int = int(maxsize)
+        self.state: str = "closed"  # Or "open", or "half_open" on trial.
+        self.opened = self.served_stale = self._count = 0
+        self._opened_at = 0.0
+        self._good = OrderedDict()  # url: last good response, LRU maxsize.
+        self._lock = Lock()
+
+    def allow(self) -> bool:
+        """True if a request may go upstream now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if (self.state == "open" and
+                    monotonic() - self._opened_at >= self.reset):
+                self.state = "half_open"  # This one is the trial request.
+                return True
+            return False
+
+    def record(self, url: str, response: tuple=None):
+        """Counts a request, response None if it raised."""
+        failed = response is None or _failed(response[0])
+        with self._lock:
+            if not failed:
+                self.state, self._count = "closed", 0
+                if 200 <= response[0] < 300:
+                    self._good[url] = response
+                    self._good.move_to_end(url)
+                    if len(self._good) > self.maxsize:
+                        self._good.popitem(last=False)
+                return
+            self._count += 1
+            if self.state == "half_open" or (
+                    self.state == "closed" and self._count >= self.failures):
+                self.state, self._opened_at = "open", monotonic()
+                self.opened += 1
+
+    def last_good(self, url: str) -> tuple:
+        """Last good (status, headers, body) of the url if stale, or None."""
+        with self._lock:
+            response = self._good.get(url) if self.stale else None
+            self.served_stale += response is not None
+        return response
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(state={self.state}, "
+                f"opened={self.opened}, served_stale={self.served_stale})")
+
+
+class RateArchive(object):
+
+    """Recorded API responses by name, saved as a compact zip archive.
+
+    Names are the base and endpoint of the url, like "USD/latest.json" or
+    "USD/historical/2018-01-01.json", the app_id is never recorded."""
+
+    __slots__ = ("bodies", )
+
+    def __init__(self, bodies: dict=None):
+        self.bodies: dict = dict(bodies or {})  # name: response body bytes.
+
+    @staticmethod
+    def name(url: str) -> str:
+        parts = urlsplit(url)
+        path = parts.path.split("/")
+        endpoint = "/".join(path[-2:] if path[-2:-1] == ["historical"]
+                            else path[-1:])
+        return f"{dict(parse_qsl(parts.query)).get('base', 'USD')}/{endpoint}"
+
+    def add(self, url: str, body: bytes):
+        self.bodies[self.name(url)] = body
+
+    def get(self, url: str) -> bytes:
+        """Recorded body for the url, None if it was not recorded."""
+        return self.bodies.get(self.name(url))
+
+    @classmethod
+    def load(cls, path: str):
+        from zipfile import ZipFile
+        with ZipFile(path) as archive:
+            return cls({name: archive.read(name)
+                        for name in archive.namelist()})
+
+    def save(self, path: str):
+        from zipfile import ZIP_DEFLATED, ZipFile
+        with ZipFile(path, "w", ZIP_DEFLATED) as archive:
+            for name, body in sorted(self.bodies.items()):
+                archive.writestr(name, body)
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self.bodies)} responses)"
+
+
+class Recorder(object):
+
+    """Transport recording the 2xx responses of another one in an archive.
+
+    client.pool = Recorder(client.pool) then archive.save() when done."""
+
+    __slots__ = ("transport", "archive")
+
+    def __init__(self, transport, archive: RateArchive=None):
+        self.transport = transport  # Like ConnectionPool.
+        self.archive: RateArchive = (archive if archive is not None
+                                     else RateArchive())
+
+    def _recorded(self, url: str, response: tuple) -> tuple:
+        if 200 <= response[0] < 300:
+            self.archive.add(url, response[2])
+        return response
+
+    def request(self, url: str, headers: dict=None, timings: dict=None):
+        return self._recorded(url, self.transport.request(url, headers,
+                                                          timings))
+
+    async def arequest(self, url: str, headers: dict=None,
+                       timings: dict=None):
+        return self._recorded(url, await self.transport.arequest(
+            url, headers, timings))
+
+    def close(self):
+        self.transport.close()
+
+
+class Replayer(object):
+
+    """Transport answering from a RateArchive in memory, no network nor quota.
+
+    latency is seconds or a (min, max) uniform range, error_rate of requests
+    get error_status and drop_rate of them a dropped connection. Unrecorded
+    urls are a 404 like the API. serve() is a local HTTP stand-in."""
+
+    __slots__ = ("archive", "latency", "error_rate", "error_status",
+                 "drop_rate", "requests", "_random", "_lock")
+
+    def __init__(self, archive, latency=0.0, error_rate: float=0.0,
+                 error_status: int=503, drop_rate: float=0.0,
+                 seed: int=None):
+        self.archive: RateArchive = (archive if isinstance(
+            archive, RateArchive) else RateArchive.load(archive))
+        self.latency = latency
+        self.error_rate: float = error_rate
+        self.error_status: int = error_status
+        self.drop_rate: float = drop_rate
+        self.requests = 0
+        self._random = Random(seed)  # Same seed, same errors and latency.
+        self._lock = Lock()
+
+    def _delay(self) -> float:
+        if isinstance(self.latency, tuple):
+            return self._random.uniform(*self.latency)
+        return self.latency
+
+    def _reply(self, url: str, headers: dict=None) -> tuple:
+        """(status, headers, body) for the url, None if dropped."""
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+        if roll < self.drop_rate:
+            return None
+        response_headers = HTTPMessage()
+        response_headers["Content-Type"] = "application/json; charset=utf-8"
+        body = self.archive.get(url)
+        if roll < self.drop_rate + self.error_rate or body is None:
+            status = self.error_status if body is not None else 404
+            return status, response_headers, dumps({
+                "error": True, "status": status, "message": "replayer",
+                "description": "Injected error or not recorded."}).encode()
+        etag = f'"{zlib.crc32(body):08x}"'
+        response_headers["ETag"] = etag
+        if (headers or {}).get("If-None-Match") == etag:
+            return 304, response_headers, b""
+        return 200, response_headers, body
+
+    def request(self, url: str, headers: dict=None, timings: dict=None):
+        sleep(self._delay())
+        response = self._reply(url, headers)
+        if response is None:
+            raise ConnectionResetError("Connection dropped by Replayer.")
+        return response
+
+    async def arequest(self, url: str, headers: dict=None,
+                       timings: dict=None):
+        await asyncio.sleep(self._delay())
+        response = self._reply(url, headers)
+        if response is None:
+            raise ConnectionResetError("Connection dropped by Replayer.")
+        return response
+
+    def close(self):
+        pass
+
+    def serve(self, host: str="127.0.0.1", port: int=0):
+        """Serves the archive over HTTP/1.1 keep-alive on a daemon thread.
+
+        Returns the server, use its .url as base_url and close() it."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        replayer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version, disable_nagle_algorithm = "HTTP/1.1", True
+
+            def do_GET(self):
+                sleep(replayer._delay())
+                response = replayer._reply(self.path, dict(self.headers))
+                if response is None:
+                    self.close_connection = True
+                    return
+                status, headers, body = response
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def close(self):
+                self.shutdown()
+                self.server_close()
+
+            def __exit__(self, *args, **kwargs):
+                self.close()
+
+        server = Server((host, port), Handler)
+        server.url = f"http://{host}:{server.server_address[1]}/api"
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}({self.archive!r}, "
+                f"latency={self.latency}, error_rate={self.error_rate}, "
+                f"drop_rate={self.drop_rate}, requests={self.requests})")
+
+
 class OpenExchangeRates(object):
 
     """Client for openexchangerate.org."""
 
     __slots__ = ("api_key", "timeout", "use_float", "round_float",
-                 "base", "local_base", "tipe", "html_table_header")
+                 "base", "local_base", "tipe", "html_table_header", "cache",
+                 "base_url", "pool", "store", "refresh_error", "_snapshot",
+                 "_refresher", "_stop_refresh", "_refresh_lock", "_names",
+                 "flight", "hooks",
+                 "budget", "retry", "breaker")
     BASE_URL = 'https://openexchangerates.org/api'
     ENDPOINT_LATEST = BASE_URL + '/latest.json'
     ENDPOINT_CURRENCIES = BASE_URL + '/currencies.json'
     ENDPOINT_HISTORICAL = BASE_URL + '/historical/%s.json'
+    TABLE_PRIORITY = ("EUR", "USD")  # On top of the rendered tables.
+    _TABLE_ROWS = {
+        "html": "<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td></tr>",
+        "csv": "{0},{1},{2},{3}\r\n",
+        "jsonl": '{{"index": {0}, "code": {1}, "price": {2}, "name": {3}}}\n'}
 
-    def __init__(self, api_key: str, timeout: int=60, use_float: bool=True,
-                 round_float: bool=True, base: str='USD', local_base: str=None):
+    def __init__(self, api_key: str, timeout: float=60, use_float: bool=True,
+                 round_float: bool=True, base: str='USD', local_base: str=None,
+                 cache: ResponseCache=None, pool_size: int=4,
+                 idle_timeout: int=30, base_url: str=BASE_URL,
+                 store: SnapshotStore=None, hooks: tuple=(),
+                 budget: RequestBudget=None, transport=None,
+                 connect_timeout: float=None, retry: Retry=None,
+                 breaker: CircuitBreaker=None):
 
         self.api_key: str = str(api_key).strip()
-        self.timeout: int = int(timeout)
+        self.timeout: float = float(timeout)
         self.local_base: str = local_base
         self.base: str = str(base).upper()
         self.use_float: bool = use_float
         self.round_float: bool = round_float
         self.html_table_header: bool = True
+        self.cache: ResponseCache = cache
+        self.store: SnapshotStore = store
+        self.refresh_error: Exception = None  # Last failed auto-refresh.
+        self._snapshot = None  # (Rates, time.time()) swapped by refresher.
+        self._refresher = self._stop_refresh = None
+        self._refresh_lock = Lock()  # Stopping vs. swapping the snapshot.
+        self._names = None  # Cached currency_names().
+        self.flight = SingleFlight()  # Identical concurrent calls share.
+        self.hooks: tuple = tuple(hooks)  # Called with an event per call.
+        self.budget: RequestBudget = budget
+        self.retry: Retry = retry
+        self.breaker: CircuitBreaker = breaker
+        self.base_url: str = base_url.rstrip("/")
+        self.pool = transport if transport is not None else ConnectionPool(
+            self.base_url, self.timeout, pool_size, idle_timeout,
+            connect_timeout)
         self.tipe = _RoundedFloat                    # Floats, Round.
         if self.use_float and not self.round_float:
             self.tipe = float                        # Floats, Not Round.
         elif not self.use_float:
             self.tipe = decimal.Decimal              # Decimal, Not Round.
 
-    def _parsed_response(self, response):
-        data = loads(response, parse_int=self.tipe,
-                     parse_float=self.tipe)['rates']
+    def _rates(self, data: dict):
+        return Rates(data, self, self.local_base)
+
+    def _parsed_response(self, response, timings: dict=None):
+        return self._rates(self._parsed_rates(response, timings))
 
-        if self.local_base:
-            data = self._local_conversion(data, self.local_base)
+    def _parsed_rates(self, response, timings: dict=None) -> dict:
+        """Decodes {"rates": {CODE: number}}, the numbers as self.tipe."""
+        if self.tipe is decimal.Decimal:  # Needs the numbers as text.
+            return loads(response, parse_int=self.tipe,
+                         parse_float=self.tipe)['rates']
+        rates = (_fast_loads or loads)(response)['rates']
+        if timings is None:
+            return dict(zip(rates, map(self.tipe, rates.values())))  # 1 pass
+        start = perf_counter()
+        rates = dict(zip(rates, map(self.tipe, rates.values())))
+        timings["convert"] = perf_counter() - start
+        return rates
 
-        return namedtuple(
-            "OpenExchangeRates", "dict frozendict html namedtuple")(
-            data, frozendict(data), self.html(data),
-            namedtuple("OpenExchangeRates", data.keys())(*data.values()))
+    @staticmethod
+    def _parsed_currencies(response, timings: dict=None):
+        return Rates(loads(response))
 
     def _local_conversion(self, data, local_base):
         """Change base using local conversion,offline,useful for free plan."""
-        new_rates = {}
-        for curr, value in data.items():
-            new_rates[curr] = round(value / data[local_base], 8)
-        return new_rates
+        return RateTable.from_dict(data).rebase(local_base).to_dict(8)
+
+    def _url(self, path: str) -> str:
+        return (f"{ self.base_url }{ path }?"
+                f"{ urlencode({'app_id': self.api_key, 'base': self.base}) }")
+
+    def _cached(self, url: str):
+        """Returns (fresh cached body or None, request headers)."""
+        if self.cache is None:
+            return None, None
+        return self.cache.lookup(url)
+
+    def _response_body(self, url, endpoint, status, headers, body):
+        """Checks the HTTP status, returns body or None to fetch again."""
+        if status == 304 and self.cache is not None:
+            return self.cache.revalidated(url, endpoint)
+        if not 200 <= status < 300:
+            raise HTTPError(url, status, body.decode("utf-8", "replace"),
+                            headers, None)
+        if self.cache is not None and not isinstance(body, _StaleBody):
+            self.cache.store(url, endpoint, headers, body)
+        return body
+
+    def _fetch(self, url: str, endpoint: str, event: dict=None):
+        """GET the url, going through the response cache if any."""
+        body, headers = self._cached(url)
+        if body is not None:
+            if event is not None:
+                event["cache"] = "hit"
+            return body
+        status, response_headers, body = self._request(
+            url, endpoint, headers, None if event is None else event["timings"])
+        if event is not None:
+            self._observed_response(event, status, body)
+        body = self._response_body(url, endpoint, status, response_headers,
+                                   body)
+        return self._fetch(url, endpoint, event) if body is None else body
+
+    def _attempt(self, url: str, endpoint: str, headers: dict=None,
+                 timings: dict=None) -> tuple:
+        """1 GET within the budget, counted by the retry and the breaker."""
+        if self.budget is not None:
+            self.budget.acquire(endpoint)
+        start = perf_counter()
+        try:
+            response = self.pool.request(url, headers, timings)
+        except Exception:
+            if self.breaker is not None:
+                self.breaker.record(url)
+            raise
+        self._attempted(url, response, start)
+        return response
+
+    def _attempted(self, url: str, response: tuple, start: float):
+        if self.breaker is not None:
+            self.breaker.record(url, response)
+        if self.retry is not None and not _failed(response[0]):
+            self.retry.observe(perf_counter() - start)
+
+    def _hedged(self, url: str, endpoint: str, headers: dict=None,
+                timings: dict=None) -> tuple:
+        """_attempt(), sending a 2nd one if the 1st is slow, first wins."""
+        delay = None if self.retry is None else self.retry.hedge_delay()
+        if delay is None:
+            return self._attempt(url, endpoint, headers, timings)
+        executor = self.retry.executor()
+        first = executor.submit(self._attempt, url, endpoint, headers,
+                                timings)
+        if futures.wait((first, ), delay)[0] or not self._allowed():
+            return first.result()
+        self.retry.hedged += 1
+        second = executor.submit(self._attempt, url, endpoint, headers, None)
+        done, pending = futures.wait((first, second),
+                                     return_when=futures.FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            return pending.pop().result()  # The other one may still work.
+        return winner.result()
+
+    def _allowed(self) -> bool:
+        return self.breaker is None or self.breaker.allow()
+
+    def _give_up(self, url: str, error: Exception=None,
+                 response: tuple=None):
+        """Last good response if the breaker has one, else fails."""
+        stale = None if self.breaker is None else self.breaker.last_good(url)
+        if stale is not None:
+            return stale[0], stale[1], _StaleBody(stale[2])
+        if response is not None:
+            return response  # Raised as HTTPError by _response_body().
+        raise error
+
+    def _request(self, url: str, endpoint: str, headers: dict=None,
+                 timings: dict=None) -> tuple:
+        """GET through the circuit breaker, retries and hedged requests."""
+        attempts = 1 if self.retry is None else self.retry.attempts
+        for attempt in range(attempts):
+            if not self._allowed():
+                return self._give_up(url, CircuitOpen(
+                    f"Circuit open, {url.split('?')[0]} not requested."))
+            try:
+                response = self._hedged(url, endpoint, headers, timings)
+            except (OSError, HTTPException) as error:
+                if attempt + 1 == attempts:
+                    return self._give_up(url, error)
+            else:
+                if not _failed(response[0]):
+                    return response
+                if attempt + 1 == attempts:
+                    return self._give_up(url, response=response)
+            self.retry.retried += 1
+            sleep(self.retry.delay(attempt))
+
+    def _observed_response(self, event: dict, status: int, body=b""):
+        if isinstance(body, _StaleBody):
+            event["cache"] = "stale"  # Nothing answered, no status.
+            return
+        event["status"] = status
+        if self.cache is not None:
+            event["cache"] = "revalidated" if status == 304 else "miss"
+
+    @staticmethod
+    def _event(endpoint: str) -> dict:
+        return {"endpoint": endpoint, "status": None, "bytes": 0,
+                "cache": None, "error": None, "timings": {}}
+
+    def _emit(self, event: dict, start: float):
+        event["timings"]["total"] = perf_counter() - start
+        for hook in self.hooks:
+            hook(event)
+
+    @staticmethod
+    def _parsed(parse, body, timings: dict=None):
+        """parse(body), Rates from a stale body are flagged as stale."""
+        if not isinstance(body, _StaleBody):
+            return parse(body, timings)
+        result = parse(bytes(body), timings)
+        result.stale = True
+        return result
+
+    def _observed_parse(self, event: dict, parse, body):
+        event["bytes"] = len(body)
+        start = perf_counter()
+        result = self._parsed(parse, body, event["timings"])
+        event["timings"]["decode"] = (perf_counter() - start -
+                                      event["timings"].get("convert", 0))
+        return result
+
+    def _call(self, endpoint: str, url: str, parse):
+        """Fetches and parses the url, reporting an event to the hooks."""
+        if not self.hooks:  # Nothing to measure, nothing to pay for.
+            return self._parsed(parse, self._fetch(url, endpoint))
+        event, start = self._event(endpoint), perf_counter()
+        try:
+            return self._observed_parse(event, parse,
+                                        self._fetch(url, endpoint, event))
+        except Exception as error:
+            event["error"] = error
+            raise
+        finally:
+            self._emit(event, start)
+
+    def _historical_url(self, since_date: datetime) -> str:
+        if isinstance(since_date, datetime):
+            since_date = since_date.strftime(r'%Y-%m-%d')
+        return self._url(f"/historical/{ since_date }.json")
 
     def latest(self):
-        """Fetches latest exchange rate data from openexchangerates."""
-        url = (f"{ self.ENDPOINT_LATEST }?"
-               f"{ urlencode({'app_id': self.api_key, 'base': self.base}) }")
-        response = urlopen(url, timeout=self.timeout).read()
-        return self._parsed_response(response)
+        """Fetches latest exchange rate data from openexchangerates.
+
+        With start_refresh() returns the last refreshed rates right away."""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot[0]
+        return self._latest()
+
+    def _latest(self):
+        url = self._url("/latest.json")
+        return self.flight.do(url, lambda: self._call(
+            "latest", url, self._parsed_response))
+
+    def latest_many(self, bases) -> dict:
+        """Latest rates for every base from 1 fetch, {base: RateTable}.
+
+        The tables are views sharing one array of rates, nothing is copied."""
+        table = self.latest().table
+        return {base: table.rebase(base) for base in map(str.upper, bases)}
+
+    def changes(self, interval: float=3600, rel_tol: float=0.0,
+                abs_tol: float=0.0):
+        """Polls latest() every interval seconds, yields the rates that moved.
+
+        Yields {code: rate}, as in .table, of the rates that moved past the
+        rel_tol or abs_tol since last yielded, the first poll yields all.
+        Goes through the cache and start_refresh() rates, polls returning
+        the same rates cost no diff and yield nothing. Polls failing with
+        a timeout, a 5xx or CircuitOpen are skipped, other errors raise."""
+        reported, last = {}, None
+        while True:
+            try:
+                table = self.latest().table
+            except Exception as error:
+                if not (_transient(error) or isinstance(error, CircuitOpen)):
+                    raise
+                sleep(interval)  # Upstream hiccup, keep what was reported.
+                continue
+            if last is None or (table.base, table.rates) != (last.base,
+                                                             last.rates):
+                moved = table.moved(reported, rel_tol, abs_tol)
+                if moved:
+                    reported.update(moved)
+                    yield moved
+            last = table
+            sleep(interval)
+
+    @property
+    def refreshed_at(self) -> float:
+        """time.time() of the rates latest() returns, None if not refreshing.
+
+        If refresh_error is set the rates are stale since this timestamp."""
+        snapshot = self._snapshot
+        return None if snapshot is None else snapshot[1]
+
+    def _refresh(self, stop: Event=None):
+        try:
+            rates = self._latest()
+        except Exception as error:
+            with self._refresh_lock:
+                if stop is None or not stop.is_set():
+                    self.refresh_error = error  # Keep the last good rates.
+        else:
+            self._refreshed(rates, stop)
+
+    def _refreshed(self, rates: Rates, stop: Event=None):
+        """Swaps the rates in, unless they are the breaker's stale ones.
+
+        Does nothing once stop is set, stop_refresh() may have run while
+        the rates were in flight."""
+        with self._refresh_lock:
+            if stop is not None and stop.is_set():
+                return
+            if rates.stale:
+                self.refresh_error = CircuitOpen(
+                    "Upstream is unhealthy, kept the last refreshed rates.")
+            else:
+                self._snapshot, self.refresh_error = (rates, time()), None
+
+    def _refresh_loop(self, interval: float, stop: Event):
+        while not stop.wait(interval):
+            self._refresh(stop)
+
+    def start_refresh(self, interval: float=3600):
+        """Refreshes latest() every interval seconds on a daemon thread.
+
+        Fetches the first rates now, raising if that fails. If a later
+        refresh fails, latest() keeps serving the last good rates."""
+        self.stop_refresh()
+        self._refreshed(self._latest())
+        if self._snapshot is None:  # Stale rates from the breaker.
+            raise self.refresh_error
+        self._stop_refresh = Event()
+        self._refresher = Thread(target=self._refresh_loop, daemon=True,
+                                 args=(interval, self._stop_refresh),
+                                 name=f"{self.__class__.__name__}.refresh")
+        self._refresher.start()
+
+    def stop_refresh(self):
+        """Stops the auto-refresh, latest() fetches on every call again."""
+        with self._refresh_lock:  # An in flight refresh can not swap now.
+            if self._refresher is not None:
+                self._stop_refresh.set()
+                self._refresher = self._stop_refresh = None
+            self._snapshot = None
 
     def currencies(self):
         """Fetches current currency data from openexchangerates."""
-        url = (f"{ self.ENDPOINT_CURRENCIES }?"
-               f"{ urlencode({'app_id': self.api_key, 'base': self.base}) }")
-        data = loads(urlopen(url, timeout=self.timeout).read())
-        return namedtuple("OpenExchangeRates", "dict frozendict namedtuple")(
-            data, frozendict(data),
-            namedtuple("OpenExchangeRates", data.keys())(*data.values()))
+        url = self._url("/currencies.json")
+        return self.flight.do(url, lambda: self._call(
+            "currencies", url, self._parsed_currencies))
+
+    def _stored(self, since_date):
+        """Rates from the snapshot store, or None if not stored there."""
+        if self.tipe is decimal.Decimal:  # float64 would lose the digits.
+            return None
+        start = perf_counter()
+        data = self.store.rates(since_date, self.base, self.tipe)
+        if data is None:
+            return None
+        if self.hooks:
+            event = self._event("historical")
+            event["cache"] = "store"
+            self._emit(event, start)
+        return self._rates(data)
+
+    def _parsed_historical(self, since_date, response, timings: dict=None):
+        rates = self._parsed_response(response, timings)
+        if self.store is not None:
+            self.store.append(since_date, self.base, rates.raw)
+        return rates
 
     def historical(self, since_date: datetime):
         """Fetches historical exchange rate data from openexchangerates."""
-        if isinstance(since_date, datetime):
-            since_date = since_date.strftime(r'%Y-%m-%d')
-        url = (f"{ self.ENDPOINT_HISTORICAL % since_date }?"
-               f"{ urlencode({'app_id': self.api_key, 'base': self.base}) }")
-        response = urlopen(url, timeout=self.timeout).read()
-        return self._parsed_response(response)
+        if self.store is not None:
+            rates = self._stored(since_date)
+            if rates is not None:
+                return rates
+        url = self._historical_url(since_date)
+        return self.flight.do(url, lambda: self._call(
+            "historical", url, lambda response, timings:
+            self._parsed_historical(since_date, response, timings)))
+
+    def historical_many(self, since_date, bases) -> dict:
+        """Historical rates for every base from 1 fetch, {base: RateTable}.
+
+        The tables are views sharing one array of rates, nothing is copied."""
+        table = self.historical(since_date).table
+        return {base: table.rebase(base) for base in map(str.upper, bases)}
+
+    def prewarm(self, start, end, step: timedelta=timedelta(days=1),
+                workers: int=8, retries: int=2) -> int:
+        """Fetches into the snapshot store the dates not there yet.
+
+        Returns how many dates were fetched."""
+        missing = self._missing(start, end, step)
+        if missing:
+            workers = min(workers, len(missing))
+            with futures.ThreadPoolExecutor(workers) as executor:
+                tuple(executor.map(self._historical_retry, missing,
+                                   [retries] * len(missing)))
+        return len(missing)
+
+    def _missing(self, start, end, step: timedelta) -> list:
+        """Dates from start to end not in the snapshot store yet."""
+        if self.store is None:
+            raise ValueError("prewarm() fills the snapshot store, pass "
+                             "store=SnapshotStore(path) to the client.")
+        return [day for day in self._days(start, end, step)
+                if (day, self.base) not in self.store]
+
+    @staticmethod
+    def _days(start, end, step: timedelta) -> list:
+        if step <= timedelta(0):
+            raise ValueError(f"step must be a positive timedelta, not {step}.")
+        day, end, days = _day(start), _day(end), []
+        while day <= end:
+            days.append(day)
+            day += step
+        return days
 
-    def html(self, prices_data_dict: dict):
-        names_get = self.currencies().frozendict.get
-        prices = tuple(enumerate(prices_data_dict.items()))
-        row = "<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td></tr>"
-        h = "<thead><th>#</th><th>Code</th><th>Price</th><th>Name</th></thead>"
+    def _historical_retry(self, since_date, retries: int):
+        if self.retry is not None:  # Already retried by the Retry policy.
+            retries = 0
+        for attempt in range(retries + 1):
+            try:
+                return self.historical(since_date).dict
+            except Exception as error:
+                if attempt == retries or not _transient(error):
+                    raise
+                sleep(0.5 * 2 ** attempt)
 
-        rows = [row.format(index, mony[0], mony[1], names_get(mony[0], "???"))
-                for index, mony in prices
-                if mony[0] not in ("EUR", "USD")]  # Skip Dollar and Euro.
+    def historical_range(self, start, end, step: timedelta=timedelta(days=1),
+                         workers: int=8, retries: int=2) -> RateSeries:
+        """Fetches historical rates from start to end (inclusive) in parallel.
 
-        prio = [row.format(index, mony[0], mony[1], names_get(mony[0], "???"))
-                for index, mony in prices
-                if mony[0] in ("EUR", "USD")]  # Move Dollar and Euro at Top.
+        At most workers requests at the same time, transient errors are
+        retried with exponential backoff, by the client retry policy if it
+        has one, else retries times. Returns a RateSeries."""
+        days = self._days(start, end, step)
+        workers = max(1, min(workers, len(days)))
+        with futures.ThreadPoolExecutor(workers) as executor:
+            rates = list(executor.map(self._historical_retry, days,
+                                      [retries] * len(days)))
+        return RateSeries(days, rates)
 
-        return (f"<table>{ h if self.html_table_header else ''}"
-                f"<tbody>{' '.join(prio + rows)}</tbody></table>")
+    def currency_names(self):
+        """Currency code: name frozendict, fetched once and then cached."""
+        if self._names is None:
+            self._names = self.currencies().frozendict
+        return self._names
+
+    def _table_names(self, names):
+        return self.currency_names() if names is None else names
+
+    def _table_rows(self, prices_data_dict, names_get):
+        """(index, code, price, name) rows, EUR and USD first, 1 pass.
+
+        Rows before the last of them are held back until it is found."""
+        priority = self.TABLE_PRIORITY
+        wanted = sum(code in prices_data_dict for code in priority)
+        held = []
+        for index, (code, price) in enumerate(prices_data_dict.items()):
+            row = index, code, price, names_get(code, "???")
+            if not wanted:
+                yield row
+            elif code in priority:  # Dollar, Euro at Top.
+                wanted -= 1
+                yield row
+                if not wanted:
+                    yield from held
+                    held = None
+            else:
+                held.append(row)
+
+    def iter_table(self, prices_data_dict: dict, fmt: str="html",
+                   names=None, encoding: str=None, chunk_rows: int=32):
+        """Renders the rates table as chunks, fmt is html, csv or jsonl.
+
+        Yields str, or bytes if encoding, for streaming responses:
+        WSGI apps can return client.iter_table(rates, encoding="utf-8")."""
+        rows = self._table_rows(prices_data_dict,
+                                self._table_names(names).get)
+        head, tail, sep = "", "", ""
+        if fmt == "html":
+            head = ("<thead><th>#</th><th>Code</th><th>Price</th>"
+                    "<th>Name</th></thead>") if self.html_table_header else ""
+            head, tail, sep = f"<table>{ head }<tbody>", "</tbody></table>", " "
+        elif fmt == "csv":
+            head = "#,Code,Price,Name\r\n" if self.html_table_header else ""
+            rows = ((index, code, price, '"' + name.replace('"', '""') + '"'
+                     if '"' in name or "," in name else name)
+                    for index, code, price, name in rows)
+        elif fmt == "jsonl":
+            rows = ((index, dumps(code), price, dumps(name))
+                    for index, code, price, name in rows)
+        lines = starmap(self._TABLE_ROWS[fmt].format, rows)
+        chunk = head + sep.join(islice(lines, chunk_rows))
+        while True:
+            rendered = sep.join(islice(lines, chunk_rows))
+            if not rendered:
+                break
+            yield chunk.encode(encoding) if encoding else chunk
+            chunk = sep + rendered
+        chunk += tail
+        if chunk:
+            yield chunk.encode(encoding) if encoding else chunk
+
+    def write_table(self, stream, prices_data_dict: dict, fmt: str="html",
+                    names=None, encoding: str="utf-8"):
+        """Writes the rates table to a text or binary file-like stream."""
+        binary = not isinstance(stream, TextIOBase)
+        for chunk in self.iter_table(prices_data_dict, fmt, names,
+                                     encoding if binary else None):
+            stream.write(chunk)
+
+    def html(self, prices_data_dict: dict, names=None):
+        if not self.hooks:
+            return "".join(self.iter_table(prices_data_dict, "html", names,
+                                           chunk_rows=1024))
+        event, start = self._event("html"), perf_counter()
+        if names is None and self._names is None:
+            names = self.currency_names()
+            event["timings"]["currencies"] = perf_counter() - start
+        render = perf_counter()
+        html = "".join(self.iter_table(prices_data_dict, "html", names,
+                                       chunk_rows=1024))
+        event["timings"]["render"], event["bytes"] = (
+            perf_counter() - render, len(html))
+        self._emit(event, start)
+        return html
 
     def __enter__(self):
         return self.latest()
 
     def __exit__(self, exception_type, exception_values, tracebacks, *args):
-        pass
+        self.pool.close()
 
     def __iter__(self):
         return iter(self.latest().dict.items())
 
     def __repr__(self):
         return (f'{self.__class__.__name__}(api_key:str={self.api_key}, '
-                f'timeout:int={self.timeout}, use_float:bool={self.use_float},'
-                f' round_float:bool={self.round_float}, base:str={self.base}, '
-                f'local_base:str={self.local_base}, tipe:type={self.tipe})')
+                f'timeout:float={self.timeout}, '
+                f'use_float:bool={self.use_float}, '
+                f'round_float:bool={self.round_float}, base:str={self.base}, '
+                f'local_base:str={self.local_base}, tipe:type={self.tipe}, '
+                f'cache:ResponseCache={self.cache})')
 
     def __str__(self):
         if self.use_float:  # decimal.Decimal is not JSON Serializable.
             return dumps(self.latest().dict, sort_keys=True, indent=4).strip()
+
+
+async def _async_request(url: str, headers: dict=None, timings: dict=None,
+                         connect_timeout: float=None):
+    """Minimal HTTP/1.1 GET over asyncio streams, returns like pool.request.
+
+    One connection per request, supports Content-Length and chunked bodies.
+    If timings is a dict, connect (DNS, TCP and TLS) and transfer are added."""
+    parts = urlsplit(url)
+    https = parts.scheme == "https"
+    path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+    start = perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(
+        parts.hostname, parts.port or (443 if https else 80),
+        ssl=True if https else None), connect_timeout)
+    if timings is not None:
+        timings["connect"], start = perf_counter() - start, perf_counter()
+    try:
+        lines = [f"GET {path} HTTP/1.1", f"Host: {parts.netloc}",
+                 "Connection: close", "Accept-Encoding: identity"]
+        lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        status = _status(await reader.readline())
+        head = (await reader.readuntil(b"\r\n\r\n")
+                if not reader.at_eof() else b"")
+        response_headers = Parser(_class=HTTPMessage).parsestr(
+            head.decode("latin-1"))
+        if "chunked" in response_headers.get("Transfer-Encoding", ""):
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                chunks.append(await reader.readexactly(size + 2))
+                if not size:
+                    break
+            body = b"".join(chunk[:-2] for chunk in chunks)
+        elif "Content-Length" in response_headers:
+            body = await reader.readexactly(
+                int(response_headers["Content-Length"]))
+        else:
+            body = await reader.read()
+        if timings is not None:
+            timings["transfer"] = perf_counter() - start
+        return status, response_headers, body
+    except asyncio.IncompleteReadError as error:  # Dropped mid-response.
+        raise IncompleteRead(error.partial, error.expected) from None
+    finally:
+        writer.close()
+
+
+def _status(line: bytes) -> int:
+    """Status code of an HTTP/1.x status line, errors like http.client."""
+    if not line:
+        raise RemoteDisconnected("Remote end closed connection without"
+                                 " response")
+    parts = line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+        raise BadStatusLine(line.decode("latin-1"))
+    try:
+        status = int(parts[1])
+    except ValueError:
+        raise BadStatusLine(line.decode("latin-1")) from None
+    if not 100 <= status <= 999:
+        raise BadStatusLine(line.decode("latin-1"))
+    return status
+
+
+class AsyncOpenExchangeRates(OpenExchangeRates):
+
+    """Asyncio client for openexchangerate.org, dependency free.
+
+    Same options as OpenExchangeRates, the endpoints are awaitable."""
+
+    __slots__ = ()
+    __iter__ = __enter__ = None  # Use "async for" and "async with" instead.
+    __str__ = OpenExchangeRates.__repr__
+
+    def _rates(self, data: dict):
+        return Rates(data, None, self.local_base)  # .html is awaitable here.
+
+    async def _fetch(self, url: str, endpoint: str, event: dict=None):
+        """GET the url, going through the response cache if any."""
+        body, headers = self._cached(url)
+        if body is not None:
+            if event is not None:
+                event["cache"] = "hit"
+            return body
+        status, response_headers, body = await self._request(
+            url, endpoint, headers, None if event is None else event["timings"])
+        if event is not None:
+            self._observed_response(event, status, body)
+        body = self._response_body(url, endpoint, status, response_headers,
+                                   body)
+        if body is None:
+            return await self._fetch(url, endpoint, event)
+        return body
+
+    async def _attempt(self, url: str, endpoint: str, headers: dict=None,
+                       timings: dict=None) -> tuple:
+        """1 GET within the budget, counted by the retry and the breaker."""
+        if self.budget is not None:
+            await self.budget.aacquire(endpoint)
+        start = perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self.pool.arequest(url, headers, timings), self.timeout)
+        except Exception:
+            if self.breaker is not None:
+                self.breaker.record(url)
+            raise
+        self._attempted(url, response, start)
+        return response
+
+    async def _hedged(self, url: str, endpoint: str, headers: dict=None,
+                      timings: dict=None) -> tuple:
+        """_attempt(), sending a 2nd one if the 1st is slow, first wins."""
+        delay = None if self.retry is None else self.retry.hedge_delay()
+        if delay is None:
+            return await self._attempt(url, endpoint, headers, timings)
+        first = asyncio.ensure_future(
+            self._attempt(url, endpoint, headers, timings))
+        if (await asyncio.wait((first, ), timeout=delay))[0] or (
+                not self._allowed()):
+            return await first
+        self.retry.hedged += 1
+        second = asyncio.ensure_future(
+            self._attempt(url, endpoint, headers, None))
+        done, pending = await asyncio.wait((first, second),
+                                           return_when=asyncio.FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            return await pending.pop()  # The other one may still work.
+        for task in pending:
+            task.cancel()
+        return winner.result()
+
+    async def _request(self, url: str, endpoint: str, headers: dict=None,
+                       timings: dict=None) -> tuple:
+        """GET through the circuit breaker, retries and hedged requests."""
+        attempts = 1 if self.retry is None else self.retry.attempts
+        for attempt in range(attempts):
+            if not self._allowed():
+                return self._give_up(url, CircuitOpen(
+                    f"Circuit open, {url.split('?')[0]} not requested."))
+            try:
+                response = await self._hedged(url, endpoint, headers, timings)
+            except (OSError, HTTPException, asyncio.TimeoutError) as error:
+                if attempt + 1 == attempts:
+                    return self._give_up(url, error)
+            else:
+                if not _failed(response[0]):
+                    return response
+                if attempt + 1 == attempts:
+                    return self._give_up(url, response=response)
+            self.retry.retried += 1
+            await asyncio.sleep(self.retry.delay(attempt))
+
+    async def _call(self, endpoint: str, url: str, parse):
+        """Fetches and parses the url, reporting an event to the hooks."""
+        if not self.hooks:  # Nothing to measure, nothing to pay for.
+            return self._parsed(parse, await self._fetch(url, endpoint))
+        event, start = self._event(endpoint), perf_counter()
+        try:
+            return self._observed_parse(
+                event, parse, await self._fetch(url, endpoint, event))
+        except Exception as error:
+            event["error"] = error
+            raise
+        finally:
+            self._emit(event, start)
+
+    async def latest(self):
+        """Fetches latest exchange rate data from openexchangerates.
+
+        With start_refresh() returns the last refreshed rates right away."""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot[0]
+        return await self._latest()
+
+    async def _latest(self):
+        url = self._url("/latest.json")
+        return await self.flight.ado(url, lambda: self._call(
+            "latest", url, self._parsed_response))
+
+    async def latest_many(self, bases) -> dict:
+        """Latest rates for every base from 1 fetch, {base: RateTable}.
+
+        The tables are views sharing one array of rates, nothing is copied."""
+        table = (await self.latest()).table
+        return {base: table.rebase(base) for base in map(str.upper, bases)}
+
+    async def changes(self, interval: float=3600, rel_tol: float=0.0,
+                      abs_tol: float=0.0):
+        """Async generator, polls latest() and yields the rates that moved."""
+        reported, last = {}, None
+        while True:
+            try:
+                table = (await self.latest()).table
+            except Exception as error:
+                if not (_transient(error) or isinstance(error, CircuitOpen)):
+                    raise
+                await asyncio.sleep(interval)  # Keep what was reported.
+                continue
+            if last is None or (table.base, table.rates) != (last.base,
+                                                             last.rates):
+                moved = table.moved(reported, rel_tol, abs_tol)
+                if moved:
+                    reported.update(moved)
+                    yield moved
+            last = table
+            await asyncio.sleep(interval)
+
+    async def historical_many(self, since_date, bases) -> dict:
+        """Historical rates for every base from 1 fetch, {base: RateTable}.
+
+        The tables are views sharing one array of rates, nothing is copied."""
+        table = (await self.historical(since_date)).table
+        return {base: table.rebase(base) for base in map(str.upper, bases)}
+
+    async def _refresh(self):
+        try:
+            rates = await self._latest()
+        except Exception as error:
+            self.refresh_error = error  # Keep serving the last good rates.
+        else:
+            self._refreshed(rates)
+
+    async def _refresh_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self._refresh()
+
+    async def start_refresh(self, interval: float=3600):
+        """Refreshes latest() every interval seconds on an asyncio task.
+
+        Fetches the first rates now, raising if that fails. If a later
+        refresh fails, latest() keeps serving the last good rates."""
+        self.stop_refresh()
+        self._refreshed(await self._latest())
+        if self._snapshot is None:  # Stale rates from the breaker.
+            raise self.refresh_error
+        self._refresher = asyncio.ensure_future(self._refresh_loop(interval))
+
+    def stop_refresh(self):
+        """Stops the auto-refresh, latest() fetches on every call again."""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+        self._snapshot = None
+
+    async def currencies(self):
+        """Fetches current currency data from openexchangerates."""
+        url = self._url("/currencies.json")
+        return await self.flight.ado(url, lambda: self._call(
+            "currencies", url, self._parsed_currencies))
+
+    async def historical(self, since_date: datetime):
+        """Fetches historical exchange rate data from openexchangerates."""
+        if self.store is not None:
+            rates = self._stored(since_date)
+            if rates is not None:
+                return rates
+        url = self._historical_url(since_date)
+        return await self.flight.ado(url, lambda: self._call(
+            "historical", url, lambda response, timings:
+            self._parsed_historical(since_date, response, timings)))
+
+    async def _historical_retry(self, since_date, retries: int):
+        if self.retry is not None:  # Already retried by the Retry policy.
+            retries = 0
+        for attempt in range(retries + 1):
+            try:
+                return (await self.historical(since_date)).dict
+            except Exception as error:
+                if attempt == retries or not _transient(error):
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def historical_range(self, start, end,
+                               step: timedelta=timedelta(days=1),
+                               workers: int=8, retries: int=2) -> RateSeries:
+        """Fetches historical rates from start to end (inclusive) in parallel.
+
+        At most workers requests at the same time, transient errors are
+        retried with exponential backoff, by the client retry policy if it
+        has one, else retries times. Returns a RateSeries."""
+        days = self._days(start, end, step)
+        rates = await self.gather(
+            *(self._historical_retry(day, retries) for day in days),
+            limit=workers)
+        return RateSeries(days, rates)
+
+    async def prewarm(self, start, end, step: timedelta=timedelta(days=1),
+                      workers: int=8, retries: int=2) -> int:
+        """Fetches into the snapshot store the dates not there yet.
+
+        Returns how many dates were fetched."""
+        missing = self._missing(start, end, step)
+        await self.gather(*(self._historical_retry(day, retries)
+                            for day in missing), limit=workers)
+        return len(missing)
+
+    async def currency_names(self):
+        """Currency code: name frozendict, fetched once and then cached."""
+        if self._names is None:
+            self._names = (await self.currencies()).frozendict
+        return self._names
+
+    def _table_names(self, names):
+        if names is None and self._names is None:
+            raise RuntimeError("await client.currency_names() first.")
+        return self._names if names is None else names
+
+    async def html(self, prices_data_dict: dict, names=None):
+        if names is None:
+            names = await self.currency_names()
+        return super().html(prices_data_dict, names)
+
+    @staticmethod
+    async def gather(*coroutines, limit: int=8, return_exceptions=False):
+        """Like asyncio.gather but running at most limit at the same time.
+
+        await client.gather(client.latest(), client.historical(day), limit=4)
+        """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def limited(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(*map(limited, coroutines),
+                                    return_exceptions=return_exceptions)
+
+    async def __aenter__(self):
+        return await self.latest()
+
+    async def __aexit__(self, exception_type, exception_values, tracebacks):
+        self.pool.close()
+
+    async def __aiter__(self):
+        for item in (await self.latest()).dict.items():
+            yield item
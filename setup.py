@@ -30,8 +30,6 @@
 ALL THE CONFIG LIVES IN SETUP.CFG,PLEASE EDIT THERE,KEEP IT SIMPLE AND CLEAN."""
 
 
-import atexit
-
 from setuptools import setup
 
 
@@ -46,41 +44,19 @@ MODULES2CYTHONIZE = ("openexchangerate.py", )
 # Dont touch below
 
 
-def post_install_cythonize():
-    """Compile *.PY to *.SO with Cython,delete *.PYC,*.C,*.PY if sucessful."""
-    import sys
-    import os
-    from pathlib import Path
-    from shutil import which, rmtree
-    from subprocess import run
-    try:
-        from site import getsitepackages
-        site_packages = getsitepackages()[0]
-    except (ImportError, Exception):
-        from distutils.sysconfig import get_python_lib
-        site_packages = get_python_lib()
-    gcc, cythoniz = which("gcc"), which("cythonize")
-    if gcc and cythoniz and site_packages and sys.platform.startswith("linux"):
-        for py_file in [(Path(site_packages) / f) for f in MODULES2CYTHONIZE]:
-            if py_file.is_file() and os.access(py_file, os.W_OK):
-                comand = f"{cythoniz} -3 --inplace --force {py_file}"
-                try:
-                    run(comand, shell=True, timeout=99, check=True)
-                except Exception as error:
-                    print(error)
-                else:
-                    print(f"CREATED Binary file: {py_file.with_suffix('.so')}")
-                    if py_file.with_suffix(".c").is_file():
-                        py_file.with_suffix(".c").unlink()  # is C Obfuscated.
-                    if py_file.is_file():
-                        print(f"DELETED unused file: {py_file}")
-                        py_file.unlink()  # Because *.SO exist and is faster.
-                rmtree(py_file.parent / "__pycache__", ignore_errors=True)
-    else:
-        print("GCC & Cython not found, install GCC & Cython for Speed up.")
-
+def cythonized():
+    """Compile *.PY to *.SO with Cython using the *.PXD typed declarations.
 
-atexit.register(post_install_cythonize)
+    Optional, without Cython or a C compiler the pure *.PY gets installed."""
+    try:
+        from Cython.Build import cythonize
+    except ImportError:
+        print("Cython not found, install GCC & Cython for Speed up.")
+        return []
+    extensions = cythonize(MODULES2CYTHONIZE, language_level=3, quiet=True)
+    for extension in extensions:
+        extension.optional = True  # A failed C build falls back to *.PY.
+    return extensions
 
 
-setup(py_modules=["openexchangerate"])
+setup(py_modules=["openexchangerate"], ext_modules=cythonized())
@@ -5,11 +5,26 @@
 """Unittests for OpenExchangeRates Client for Python 3.6+."""
 
 
+import asyncio
 import decimal
+import gc
+import importlib.util
+import io
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
-from collections import namedtuple
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from random import randint
+from threading import Barrier, Thread
 from types import MappingProxyType as frozendict
+from unittest import mock
 
 import openexchangerate
 from httpretty import HTTPretty, httprettified
@@ -18,6 +33,41 @@ from httpretty import HTTPretty, httprettified
 unittest.TestLoader.sortTestMethodsUsing = lambda _, x, y: randint(-1, 1)
 
 
+class _FakeAPI(BaseHTTPRequestHandler):
+    """Local stand-in for openexchangerates.org, keep-alive HTTP/1.1."""
+    protocol_version, body = "HTTP/1.1", b'{"rates": {"USD": 1, "AED": 3.6}}'
+    drop_keepalive = False  # Silently close after responding, like a proxy.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+        self.close_connection = self.drop_keepalive
+
+    def log_message(self, *args):
+        pass
+
+
+def _fake_api(handler=_FakeAPI):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api"
+
+
+def _unpickled_in_worker(data: bytes):
+    """Worker side of a shared RateTable, returns its rates and any errors
+    raised while it was being collected, like SharedMemory.__del__ ones."""
+    errors, sys.unraisablehook = [], lambda error: errors.append(
+        repr(error.exc_value))
+    table = pickle.loads(data)
+    rates = table.rebase("EUR").dict
+    del table
+    gc.collect()
+    return rates, errors
+
+
 class TestOpenExchangeRates(unittest.TestCase):
 
     maxDiff, __slots__ = None, ()
@@ -59,7 +109,7 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_LATEST)
         historical = client.historical(self._date)
 
-        self.assertIsInstance(historical, tuple)
+        self.assertIsInstance(historical, openexchangerate.Rates)
         self.assertIsInstance(historical.dict, dict)
         self.assertIsInstance(historical.frozendict, frozendict)
 
@@ -82,7 +132,7 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_LATEST)
         historical = client.historical(self._date)
 
-        self.assertIsInstance(historical, tuple)
+        self.assertIsInstance(historical, openexchangerate.Rates)
         self.assertIsInstance(historical.dict, dict)
         self.assertIsInstance(historical.frozendict, frozendict)
 
@@ -104,7 +154,7 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_CURRENCIES)
         currencies = client.currencies()
 
-        self.assertIsInstance(currencies, tuple)
+        self.assertIsInstance(currencies, openexchangerate.Rates)
         self.assertIsInstance(currencies.dict, dict)
         self.assertIsInstance(currencies.frozendict, frozendict)
 
@@ -122,7 +172,7 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_LATEST)
         latest = client.latest()
 
-        self.assertIsInstance(latest, tuple)
+        self.assertIsInstance(latest, openexchangerate.Rates)
         self.assertIsInstance(latest.dict, dict)
         self.assertIsInstance(latest.frozendict, frozendict)
 
@@ -144,7 +194,7 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_LATEST)
         latest = client.latest()
 
-        self.assertIsInstance(latest, tuple)
+        self.assertIsInstance(latest, openexchangerate.Rates)
         self.assertIsInstance(latest.dict, dict)
         self.assertIsInstance(latest.frozendict, frozendict)
 
@@ -165,7 +215,7 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_LATEST)
         latest_local_conversion = client.latest()
 
-        self.assertIsInstance(latest_local_conversion, tuple)
+        self.assertIsInstance(latest_local_conversion, openexchangerate.Rates)
         self.assertIsInstance(latest_local_conversion.dict, dict)
         self.assertIsInstance(latest_local_conversion.frozendict, frozendict)
 
@@ -182,7 +232,7 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_LATEST)
         latest_cn = client.latest()
 
-        self.assertIsInstance(latest_cn, tuple)
+        self.assertIsInstance(latest_cn, openexchangerate.Rates)
         self.assertIsInstance(latest_cn.dict, dict)
         self.assertIsInstance(latest_cn.frozendict, frozendict)
 
@@ -200,7 +250,7 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_HISTORICAL)
         historical_conversion = client.historical(self._date)
 
-        self.assertIsInstance(historical_conversion, tuple)
+        self.assertIsInstance(historical_conversion, openexchangerate.Rates)
         self.assertIsInstance(historical_conversion.dict, dict)
         self.assertIsInstance(historical_conversion.frozendict, frozendict)
 
@@ -218,7 +268,7 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_HISTORICAL)
         histo_cn = client.historical("2012-12-12")
 
-        self.assertIsInstance(histo_cn, tuple)
+        self.assertIsInstance(histo_cn, openexchangerate.Rates)
         self.assertIsInstance(histo_cn.dict, dict)
         self.assertIsInstance(histo_cn.frozendict, frozendict)
 
@@ -275,7 +325,7 @@ class TestOpenExchangeRates(unittest.TestCase):
         HTTPretty.register_uri(HTTPretty.GET, client.ENDPOINT_LATEST,
                                body=self._FIXTURE_LATEST)
         with client as exchange_prices:
-            self.assertIsInstance(exchange_prices, tuple)
+            self.assertIsInstance(exchange_prices, openexchangerate.Rates)
             self.assertIsInstance(exchange_prices.dict, dict)
             self.assertIsInstance(exchange_prices.frozendict, frozendict)
 
@@ -297,3 +347,810 @@ class TestOpenExchangeRates(unittest.TestCase):
                                body=self._FIXTURE_LATEST)
         for item in client:
             self.assertIsInstance(item, tuple)
+
+    @httprettified
+    def test_lazy_html(self):
+        """Tests Rates.html is the only field that fetches currencies()."""
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY')
+        HTTPretty.register_uri(HTTPretty.GET, client.ENDPOINT_LATEST,
+                               body=self._FIXTURE_LATEST)
+        latest = client.latest()
+        self.assertEqual(latest.namedtuple.AED, 3.666311)
+        self.assertEqual(len(HTTPretty.latest_requests), 1)
+
+        HTTPretty.register_uri(HTTPretty.GET, client.ENDPOINT_CURRENCIES,
+                               body=self._FIXTURE_CURRENCIES)
+        self.assertIn("Afghan Afghani", latest.html)
+        self.assertIs(latest.html, latest.html)
+        self.assertEqual(len(HTTPretty.latest_requests), 2)
+
+    @httprettified
+    def test_cache_hit(self):
+        """Tests ResponseCache serves fresh entries without network."""
+        cache = openexchangerate.ResponseCache()
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                    cache=cache)
+        HTTPretty.register_uri(HTTPretty.GET, client.ENDPOINT_LATEST,
+                               body=self._FIXTURE_LATEST)
+        self.assertEqual(client.latest().dict, client.latest().dict)
+        self.assertEqual(dict(client), client.latest().dict)
+        self.assertEqual(len(HTTPretty.latest_requests), 1)
+        self.assertEqual(cache.stats()["hits"], 3)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    @httprettified
+    def test_cache_revalidation(self):
+        """Tests ResponseCache revalidates expired entries with ETag."""
+        cache = openexchangerate.ResponseCache(ttl={"latest": 0})
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                    cache=cache)
+        HTTPretty.register_uri(HTTPretty.GET, client.ENDPOINT_LATEST,
+                               responses=[
+                                   HTTPretty.Response(
+                                       body=self._FIXTURE_LATEST,
+                                       adding_headers={"ETag": '"v1"'}),
+                                   HTTPretty.Response(body="", status=304)])
+        first, second = client.latest(), client.latest()
+        self.assertEqual(first.dict, second.dict)
+        self.assertEqual(
+            HTTPretty.last_request.headers.get("If-None-Match"), '"v1"')
+        self.assertEqual(cache.revalidations, 1)
+
+    def test_connection_pool_reuse(self):
+        """Tests ConnectionPool reuses one keep-alive connection."""
+        server, url = _fake_api()
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                    base_url=url)
+        try:
+            for _ in range(5):
+                self.assertEqual(client.latest().dict["AED"], 3.6)
+            self.assertEqual(client.pool.created, 1)
+            self.assertEqual(client.pool.reused, 4)
+        finally:
+            server.shutdown()
+
+    def test_connection_pool_reconnect(self):
+        """Tests ConnectionPool reconnects when the server drops idle ones."""
+        handler = type("Dropping", (_FakeAPI, ), {"drop_keepalive": True})
+        server, url = _fake_api(handler)
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                    base_url=url)
+        try:
+            for _ in range(3):
+                self.assertEqual(client.latest().dict["AED"], 3.6)
+            self.assertEqual(client.pool.created, 3)
+        finally:
+            server.shutdown()
+
+    def test_connection_pool_proxy(self):
+        """Tests ConnectionPool goes through HTTP(S)_PROXY unless NO_PROXY."""
+        class Proxy(_FakeAPI):
+            seen = []
+
+            def do_GET(self):
+                self.seen.append((self.path,
+                                  self.headers["Proxy-Authorization"]))
+                super().do_GET()
+
+        server, url = _fake_api(Proxy)
+        proxy = f"http://user:p%40ss@{url.split('/')[2]}"
+        environ = {"http_proxy": proxy, "https_proxy": proxy,
+                   "no_proxy": "bypassed.invalid"}
+        try:
+            with mock.patch.dict(os.environ, environ):
+                client = openexchangerate.OpenExchangeRates(
+                    'DUMMY_API_KEY', base_url="http://rates.invalid/api")
+                pool = openexchangerate.ConnectionPool(
+                    "https://rates.invalid/api")
+                direct = openexchangerate.ConnectionPool(
+                    "http://bypassed.invalid/api")
+            self.assertEqual(client.latest().dict["AED"], 3.6)
+        finally:
+            server.shutdown()
+        self.assertEqual(client.pool.proxy, proxy)  # user:p@ss
+        self.assertEqual(Proxy.seen, [
+            ("http://rates.invalid/api/latest.json"
+             "?app_id=DUMMY_API_KEY&base=USD", "Basic dXNlcjpwQHNz")])
+        connection, _ = pool._get()
+        self.assertEqual((connection.host, connection._tunnel_host),
+                         ("127.0.0.1", "rates.invalid"))
+        self.assertEqual(connection._tunnel_headers["Proxy-Authorization"],
+                         "Basic dXNlcjpwQHNz")
+        self.assertIsNone(direct.proxy)
+
+    def test_async_client(self):
+        """Tests AsyncOpenExchangeRates endpoints and gather()."""
+        server, url = _fake_api()
+        client = openexchangerate.AsyncOpenExchangeRates(
+            'DUMMY_API_KEY', use_float=False, local_base='AED', base_url=url)
+
+        async def fetch_all():
+            return await client.gather(
+                client.latest(), *(client.historical(self._date)
+                                   for _ in range(5)), limit=2)
+
+        try:
+            results = asyncio.run(fetch_all())
+        finally:
+            server.shutdown()
+        self.assertEqual(len(results), 6)
+        for rates in results:
+            self.assertIsInstance(rates, openexchangerate.Rates)
+            self.assertEqual(rates.dict["AED"], decimal.Decimal("1"))
+        with self.assertRaises(TypeError):
+            iter(client)
+
+    def test_historical_range(self):
+        """Tests historical_range() retries and builds a RateSeries."""
+        class Flaky(_FakeAPI):
+            failures = [503]
+
+            def do_GET(self):
+                if self.failures:
+                    self.send_error(self.failures.pop())
+                else:
+                    super().do_GET()
+
+        server, url = _fake_api(Flaky)
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                    base_url=url)
+        try:
+            series = client.historical_range("2018-01-30", "2018-02-02",
+                                             workers=3)
+        finally:
+            server.shutdown()
+        self.assertEqual(len(series), 4)
+        self.assertEqual(series.codes, ("AED", "USD"))
+        self.assertEqual(list(series.by_currency("AED")), [3.6] * 4)
+        self.assertEqual(series.by_date("2018-02-01"),
+                         {"AED": 3.6, "USD": 1.0})
+        self.assertEqual(series["2018-01-31", "USD"], 1.0)
+        self.assertNotIn("2018-02-03", series)
+        for step in (timedelta(0),
+                     timedelta(days=-1)):
+            with self.assertRaises(ValueError):
+                client.historical_range("2018-01-30", "2018-02-02", step)
+        server, url = _fake_api(Flaky)
+        client = openexchangerate.OpenExchangeRates(
+            'DUMMY_API_KEY', base_url=url,
+            retry=openexchangerate.Retry(attempts=3, backoff=0.01))
+        Flaky.failures[:] = [503] * 9
+        try:
+            with self.assertRaises(openexchangerate.HTTPError):
+                client.historical_range("2018-01-30", "2018-01-30")
+        finally:
+            server.shutdown()
+        self.assertEqual(len(Flaky.failures), 6)  # Retried by Retry only.
+
+    def test_rate_table(self):
+        """Tests RateTable conversions, rebase views and Decimal mode."""
+        table = openexchangerate.RateTable.from_dict(
+            {"AED": 3.666311, "AFN": 51.2281, "USD": 1.0})
+        self.assertAlmostEqual(table.convert(2, "AED", "AFN"),
+                               2 * 51.2281 / 3.666311)
+        local = table.rebase("AED")
+        self.assertIs(local.rates, table.rates)
+        self.assertEqual(local["AED"], 1.0)
+        self.assertEqual(local.to_dict(8)["USD"], 0.27275373)
+
+        for srcs in ("USD", ["USD", "USD"], array("l", [2, 2])):
+            converted = table.convert_many([1, 10], srcs, ["AED", "AFN"])
+            self.assertAlmostEqual(converted[0], 3.666311)
+            self.assertAlmostEqual(converted[1], 512.281)
+        with mock.patch.object(openexchangerate, "_numpy", return_value=None):
+            for srcs in ("USD", [2, 2], array("q", [2, 2])):
+                converted = table.convert_many([1, 10], srcs, [0, "AFN"])
+                self.assertIsInstance(converted, array)
+                self.assertAlmostEqual(converted[0], 3.666311)
+                self.assertAlmostEqual(converted[1], 512.281)
+
+        table = openexchangerate.RateTable.from_dict(
+            {"AED": decimal.Decimal("3.666311"), "USD": decimal.Decimal(1)})
+        self.assertEqual(table.convert(decimal.Decimal(2), "USD", "AED"),
+                         decimal.Decimal("7.332622"))
+        self.assertEqual(table.convert_many([1, 2.5], "USD", "AED"),
+                         [decimal.Decimal("3.666311"),
+                          decimal.Decimal("9.1657775")])
+
+    def test_snapshot_store(self):
+        """Tests SnapshotStore serves historical() without network."""
+        server, url = _fake_api()
+        path = os.path.join(tempfile.mkdtemp(), "rates.oxr")
+        client = openexchangerate.OpenExchangeRates(
+            'DUMMY_API_KEY', round_float=False, base_url=url,
+            store=openexchangerate.SnapshotStore(path))
+        try:
+            self.assertEqual(client.prewarm("2018-01-01", "2018-01-03"), 3)
+            self.assertEqual(client.prewarm("2018-01-01", "2018-01-03"), 0)
+            aclient = openexchangerate.AsyncOpenExchangeRates(
+                'DUMMY_API_KEY', base_url=url, store=openexchangerate.
+                SnapshotStore(os.path.join(tempfile.mkdtemp(), "a.oxr")))
+            self.assertEqual(asyncio.run(aclient.prewarm("2018-02-01",
+                                                         "2018-02-03")), 3)
+            self.assertEqual(asyncio.run(aclient.prewarm("2018-02-01",
+                                                         "2018-02-03")), 0)
+        finally:
+            server.shutdown()
+        self.assertEqual(client.pool.created + client.pool.reused, 3)
+        self.assertEqual(len(aclient.store), 3)
+        self.assertEqual(aclient.store.rates("2018-02-02"),
+                         {"AED": 3.6, "USD": 1.0})
+        historical = client.historical("2018-01-02")
+        self.assertEqual(historical.dict, {"AED": 3.6, "USD": 1.0})
+
+        other = openexchangerate.SnapshotStore(path)  # Other process.
+        self.assertEqual(len(other), 3)
+        self.assertEqual(other.codes, ("USD", "AED"))
+        self.assertEqual(other.get("2018-01-03").tolist(), [1.0, 3.6])
+        self.assertIsNone(other.get("2018-01-04"))
+        other.append("2018-01-04", "USD", {"AED": 3.7})
+        self.assertIn("2018-01-04", client.store)
+        self.assertEqual(client.store.rates("2018-01-04"), {"AED": 3.7})
+        with self.assertRaises(ValueError):
+            openexchangerate.OpenExchangeRates('DUMMY_API_KEY').prewarm(
+                "2018-01-01", "2018-01-03")
+
+    def test_auto_refresh(self):
+        """Tests start_refresh() serves last good rates when upstream fails."""
+        server, url = _fake_api()
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                    base_url=url)
+        try:
+            client.start_refresh(interval=0.05)
+            first = client.latest()
+            self.assertEqual(first.dict["AED"], 3.6)
+            self.assertTrue(client._refresher.is_alive())
+        finally:
+            server.shutdown()
+            server.server_close()
+        client.pool.close()
+        for _ in range(100):
+            if client.refresh_error is not None:
+                break
+            time.sleep(0.05)
+        self.assertIsNotNone(client.refresh_error)
+        self.assertEqual(client.latest().dict, first.dict)
+        self.assertLess(client.refreshed_at, time.time())
+        client.stop_refresh()
+        self.assertIsNone(client.refreshed_at)
+
+    def test_decoders_identical(self):
+        """Tests the fast JSON decode path matches the stdlib one."""
+        body = b'{"rates": {"AED": 3.666311, "BTC": 0.000157, "USD": 1}}'
+        fast_loads = openexchangerate._fast_loads
+        for kwargs in ({}, {"round_float": False}, {"use_float": False}):
+            client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                        **kwargs)
+            expected = openexchangerate.loads(
+                body, parse_int=client.tipe, parse_float=client.tipe)["rates"]
+            try:
+                for backend in (fast_loads, None):
+                    openexchangerate._fast_loads = backend
+                    rates = client._parsed_response(body)
+                    self.assertEqual(rates.dict, expected)
+                    self.assertEqual(list(map(type, rates.dict.values())),
+                                     list(map(type, expected.values())))
+                    self.assertEqual(tuple(rates.namedtuple),
+                                     tuple(expected.values()))
+            finally:
+                openexchangerate._fast_loads = fast_loads
+
+    @httprettified
+    def test_iter_table(self):
+        """Tests streaming tables fetch currency names only once."""
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY')
+        HTTPretty.register_uri(HTTPretty.GET, client.ENDPOINT_CURRENCIES,
+                               body=self._FIXTURE_CURRENCIES)
+        prices = {"AED": 3.67, "USD": 1, "EUR": 0.8}
+        self.assertEqual(
+            "".join(client.iter_table(prices, "csv", chunk_rows=1)),
+            "#,Code,Price,Name\r\n1,USD,1,United States Dollar\r\n"
+            "2,EUR,0.8,???\r\n"
+            "0,AED,3.67,United Arab Emirates Dirham\r\n")
+        stream = io.BytesIO()
+        client.write_table(stream, prices, "jsonl")
+        self.assertEqual(stream.getvalue().splitlines()[0],
+                         b'{"index": 1, "code": "USD", "price": 1, '
+                         b'"name": "United States Dollar"}')
+        self.assertTrue(client.html(prices).startswith(
+            "<table><thead><th>#</th><th>Code</th><th>Price</th><th>Name"
+            "</th></thead><tbody><tr><td>1</td><td>USD</td>"))
+        self.assertEqual(len(HTTPretty.latest_requests), 1)
+
+        class Walked(dict):
+            walks = 0
+
+            def items(self):
+                Walked.walks += 1
+                return super().items()
+
+            def __iter__(self):
+                Walked.walks += 1
+                return super().__iter__()
+
+        rows = list(client._table_rows(Walked(prices), {}.get))
+        self.assertEqual([row[1] for row in rows], ["USD", "EUR", "AED"])
+        self.assertEqual(Walked.walks, 1)  # 1 pass over the rates.
+
+    def test_single_flight(self):
+        """Tests concurrent identical calls share one HTTP request."""
+        class Slow(_FakeAPI):
+            requests = []
+
+            def do_GET(self):
+                self.requests.append(self.path)
+                time.sleep(0.2)
+                super().do_GET()
+
+        server, url = _fake_api(Slow)
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                    base_url=url)
+        barrier, results = Barrier(8), []
+
+        def latest():
+            barrier.wait()
+            results.append(client.latest())
+
+        async def historical():
+            async_client = openexchangerate.AsyncOpenExchangeRates(
+                'DUMMY_API_KEY', base_url=url)
+            results.extend(await asyncio.gather(
+                *(async_client.historical("2018-01-01") for _ in range(4))))
+            return async_client.flight.coalesced
+
+        try:
+            threads = [Thread(target=latest) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(asyncio.run(historical()), 3)
+        finally:
+            server.shutdown()
+        self.assertEqual(len(Slow.requests), 2)
+        self.assertEqual(client.flight.coalesced, 7)
+        self.assertEqual(len(set(map(id, results))), 2)
+
+    @httprettified
+    def test_latest_many(self):
+        """Tests latest_many() derives every base from one fetch."""
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY')
+        HTTPretty.register_uri(HTTPretty.GET, client.ENDPOINT_LATEST,
+                               body=self._FIXTURE_LATEST)
+        many = client.latest_many(["aed", "USD", "ALL"])
+        self.assertEqual(len(HTTPretty.latest_requests), 1)
+        self.assertEqual(list(many), ["AED", "USD", "ALL"])
+        self.assertIs(many["AED"].rates, many["ALL"].rates)
+        self.assertEqual(many["USD"]["AED"], 3.666311)
+        self.assertEqual(many["AED"]["AED"], 1.0)
+        self.assertEqual(round(many["AED"]["AFN"], 8), 13.97265535)
+        self.assertEqual(dict(many["USD"]), {
+            "AED": 3.666311, "AFN": 51.2281, "ALL": 104.748751, "USD": 1.0})
+
+    def test_metrics_hooks(self):
+        """Tests hooks get per phase timings and Metrics exports them."""
+        server, url = _fake_api()
+        metrics, events = openexchangerate.Metrics(), []
+        client = openexchangerate.OpenExchangeRates(
+            'DUMMY_API_KEY', base_url=url, cache=openexchangerate.
+            ResponseCache(), hooks=(metrics, events.append))
+        try:
+            client.latest()
+            client.latest()
+            client.historical("2018-01-01")
+        finally:
+            server.shutdown()
+        self.assertEqual([event["cache"] for event in events],
+                         ["miss", "hit", "miss"])
+        first = events[0]
+        self.assertEqual(first["status"], 200)
+        self.assertEqual(first["bytes"], len(_FakeAPI.body))
+        self.assertEqual(set(first["timings"]),
+                         {"connect", "transfer", "decode", "convert",
+                          "total"})
+        self.assertNotIn("connect", events[2]["timings"])  # Pooled.
+        exported = metrics.as_dict()
+        self.assertEqual(exported["counters"][
+            "requests_total{endpoint=latest,status=200}"], 1)
+        self.assertEqual(exported["histograms"][
+            "phase_seconds{endpoint=latest,phase=total}"]["count"], 2)
+        text = metrics.prometheus()
+        self.assertIn('openexchangerate_requests_total{endpoint="latest",'
+                      'status="hit"} 1', text)
+        self.assertIn('openexchangerate_phase_seconds_count{endpoint='
+                      '"historical",phase="transfer"} 1', text)
+
+    @httprettified
+    def test_request_budget(self):
+        """Tests RequestBudget keeps a reserve for live calls, shared."""
+        path = os.path.join(tempfile.mkdtemp(), "budget")
+        budget = openexchangerate.RequestBudget(
+            limit=3, period=3600, reserve=1 / 3, policy="fail", path=path)
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                    budget=budget)
+        HTTPretty.register_uri(HTTPretty.GET, client.ENDPOINT_LATEST,
+                               body=self._FIXTURE_LATEST)
+        HTTPretty.register_uri(HTTPretty.GET, client.ENDPOINT_HISTORICAL %
+                               self._date, body=self._FIXTURE_HISTORICAL)
+        client.historical(self._date)
+        client.historical(self._date)
+        with self.assertRaises(openexchangerate.BudgetExceeded):
+            client.historical(self._date)  # Reserved for live calls.
+        client.latest()
+        other = openexchangerate.RequestBudget(  # Other process.
+            limit=3, period=3600, policy="fail", path=path)
+        self.assertEqual(other.used, 3)
+        with self.assertRaises(openexchangerate.BudgetExceeded):
+            other.acquire("latest")
+        self.assertLess(budget.remaining, 1)
+        self.assertEqual(len(HTTPretty.latest_requests), 3)
+
+        waiting = openexchangerate.RequestBudget(limit=1, period=0.05)
+        waiting.acquire("latest")
+        waiting.acquire("latest")  # Waits for the refill.
+        self.assertEqual(waiting.used, 2)
+
+    def test_lazy_imports(self):
+        """Tests importing the module leaves asyncio and friends unloaded."""
+        loaded = subprocess.run(
+            (sys.executable, "-c", "import sys, openexchangerate; print(["
+             "name for name in ('asyncio', 'concurrent.futures', 'logging',"
+             " 'numpy') if name in sys.modules])"),
+            check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(openexchangerate.__file__)).stdout
+        self.assertEqual(loaded.strip(), "[]")
+        self.assertIsInstance(openexchangerate.futures.ThreadPoolExecutor,
+                              type)
+
+    def test_compiled_identical(self):
+        """Tests compiled hot loops give the same bits and errors as Python."""
+        source = os.path.join(os.path.dirname(openexchangerate.__file__),
+                              "openexchangerate.py")
+        if not os.path.isfile(source):
+            self.skipTest("openexchangerate.py not found, only compiled.")
+        spec = importlib.util.spec_from_file_location("_pure", source)
+        pure = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(pure)
+        self.assertFalse(pure.COMPILED)
+        codes, rates = ("USD", "EUR", "JPY"), array('d', [1, 0.9, 151.3])
+        amounts = array('d', [1, 0.1, 1e9, -3.3])
+        srcs, dsts = array('q', [0, 1, 2, 1]), array('q', [2, 0, 1, 1])
+        for module in (openexchangerate, pure):
+            self.assertEqual(
+                repr(module._rebased_floats(codes, rates, 0.9, 4)),
+                repr(pure._rebased_floats(codes, rates, 0.9, 4)))
+            self.assertEqual(
+                repr(module._rebased_floats(codes, rates, 3.0, None)),
+                repr(pure._rebased_floats(codes, rates, 3.0, None)))
+            self.assertEqual(
+                module._converted_floats(amounts, rates, srcs,
+                                         dsts).tobytes(),
+                pure._converted_floats(amounts, rates, srcs, dsts).tobytes())
+            with self.assertRaises(IndexError):
+                module._converted_floats(amounts, rates, srcs, array(
+                    'q', [0, 0, 0, 3]))
+            with self.assertRaises(ZeroDivisionError):
+                module._rebased_floats(codes, rates, 0.0, None)
+        data = {"USD": 1.0, "EUR": 0.9, "JPY": 151.3}
+        self.assertEqual(
+            repr(openexchangerate.RateTable.from_dict(data).rebase(
+                "EUR").to_dict(6)),
+            repr(pure.RateTable.from_dict(data).rebase("EUR").to_dict(6)))
+
+    def test_pickle_rate_table(self):
+        """Tests RateTable pickles compactly and shares memory with workers."""
+        table = openexchangerate.RateTable.from_dict(
+            {"USD": 1.0, "EUR": 0.9, "JPY": 151.3})
+        other = openexchangerate.RateTable.from_dict(
+            {"USD": 1.0, "EUR": 0.8, "JPY": 150.1})
+        self.assertIs(table.index, other.index)  # Interned, shared.
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            restored = pickle.loads(pickle.dumps(table.rebase("EUR"),
+                                                 protocol=protocol))
+            self.assertEqual(restored.dict, table.rebase("EUR").dict)
+            self.assertIs(restored.index, table.index)
+        buffers = []
+        data = pickle.dumps(table, protocol=5, buffer_callback=buffers.append)
+        self.assertEqual(len(buffers), 1)
+        self.assertLess(len(data), 100)  # Rates are out-of-band.
+        restored = pickle.loads(data, buffers=buffers)
+        self.assertEqual(restored.frozendict, frozendict(table.dict))
+        self.assertEqual(restored.convert(9, "EUR", "JPY"),
+                         table.convert(9, "EUR", "JPY"))
+        decimals = openexchangerate.RateTable.from_dict(
+            {"USD": decimal.Decimal(1), "EUR": decimal.Decimal("0.9")})
+        self.assertEqual(pickle.loads(pickle.dumps(decimals)).dict,
+                         decimals.dict)
+        rates = openexchangerate.Rates({"USD": 1, "EUR": 0.9}, None, "EUR")
+        self.assertEqual(pickle.loads(pickle.dumps(rates)).dict, rates.dict)
+
+        with table.share() as shared:
+            attached = pickle.loads(pickle.dumps(shared.rebase("EUR")))
+            self.assertEqual(attached.dict, table.rebase("EUR").dict)
+            shared.rates[2] = 160.0  # Same memory, no copy.
+            self.assertEqual(attached["JPY"], 160.0 / 0.9)
+            attached.close()
+            with ProcessPoolExecutor(2) as pool:
+                for rates, errors in pool.map(_unpickled_in_worker,
+                                              [pickle.dumps(shared)] * 4):
+                    self.assertEqual(rates, shared.rebase("EUR").dict)
+                    self.assertEqual(errors, [])
+        with self.assertRaises(TypeError):
+            decimals.share()
+
+    def test_changes(self):
+        """Tests changes() yields only the rates that moved past tolerance."""
+        class Moving(_FakeAPI):
+            bodies = [b'{"rates": {"USD": 1, "EUR": 0.9, "JPY": 150.0}}',
+                      b'{"rates": {"USD": 1, "EUR": 0.9, "JPY": 150.0}}',
+                      None,  # 503 between 2 good polls.
+                      b'{"rates": {"USD": 1, "EUR": 0.9001, "JPY": 150.0}}',
+                      b'{"rates": {"USD": 1, "EUR": 0.9002, "JPY": 152.0}}',
+                      b'{"rates": {"USD": 1, "EUR": 0.95, "JPY": 152.0}}']
+
+            def do_GET(self):
+                self.body = (self.bodies.pop(0) if len(self.bodies) > 1
+                             else self.bodies[0])
+                if self.body is None:
+                    self.send_error(503)
+                else:
+                    super().do_GET()
+
+        server, url = _fake_api(Moving)
+        expected = [{"USD": 1.0, "EUR": 0.9, "JPY": 150.0},
+                    {"EUR": 0.9002, "JPY": 152.0}, {"EUR": 0.95}]
+        client = openexchangerate.OpenExchangeRates(
+            'DUMMY_API_KEY', base_url=url, round_float=False)
+        try:
+            changes = client.changes(interval=0, rel_tol=2e-4)
+            self.assertEqual([next(changes) for _ in expected], expected)
+            Moving.bodies[:] = [b'{"rates": {"USD": 1, "EUR": 0.9}}', None,
+                                b'{"rates": {"USD": 1, "EUR": 0.8}}']
+            aclient = openexchangerate.AsyncOpenExchangeRates(
+                'DUMMY_API_KEY', base_url=url, local_base="EUR")
+
+            async def first_two():
+                changes = aclient.changes(interval=0, abs_tol=0.01)
+                return [await changes.__anext__() for _ in range(2)]
+
+            self.assertEqual(asyncio.run(first_two()),
+                             [{"USD": 1 / 0.9, "EUR": 1.0},
+                              {"USD": 1.25}])
+        finally:
+            server.shutdown()
+            server.server_close()
+            client.pool.close()
+
+    def test_record_replay(self):
+        """Tests Recorder archives and Replayer serves without the API."""
+        server, url = _fake_api()
+        client = openexchangerate.OpenExchangeRates(
+            'SECRET_API_KEY', base_url=url, use_float=False)
+        client.pool = recorder = openexchangerate.Recorder(client.pool)
+        try:
+            latest = client.latest()
+            client.currencies()
+            client.historical(self._date)
+        finally:
+            server.shutdown()
+            server.server_close()
+            client.pool.close()
+        self.assertEqual(sorted(recorder.archive.bodies), [
+            "USD/currencies.json", f"USD/historical/{self._date}.json",
+            "USD/latest.json"])
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "rates.zip")
+            recorder.archive.save(path)
+            with open(path, "rb") as archive:
+                self.assertNotIn(b"SECRET_API_KEY", archive.read())
+            replayer = openexchangerate.Replayer(path, latency=(0, 0.01))
+
+        client = openexchangerate.OpenExchangeRates(
+            'OTHER_KEY', use_float=False, transport=replayer,
+            cache=openexchangerate.ResponseCache(ttl={"latest": 0}))
+        self.assertEqual(client.latest().dict, latest.dict)
+        self.assertEqual(client.latest().dict, latest.dict)  # As 304.
+        self.assertEqual(client.cache.revalidations, 1)
+        with self.assertRaises(openexchangerate.HTTPError) as error:
+            client.historical("2000-01-01")  # Not recorded.
+        self.assertEqual(error.exception.code, 404)
+        replayer.error_rate = 1.0
+        with self.assertRaises(openexchangerate.HTTPError) as error:
+            client.currencies()
+        self.assertEqual(error.exception.code, 503)
+        replayer.error_rate, replayer.drop_rate = 0.0, 1.0
+        with self.assertRaises(ConnectionError):
+            client.currencies()
+        self.assertEqual(replayer.requests, 5)
+
+        replayer.drop_rate = 0.0
+        with replayer.serve() as stand_in:
+            aclient = openexchangerate.AsyncOpenExchangeRates(
+                'OTHER_KEY', use_float=False, base_url=stand_in.url)
+            self.assertEqual(asyncio.run(aclient.latest()).dict, latest.dict)
+            client = openexchangerate.OpenExchangeRates(
+                'OTHER_KEY', use_float=False, base_url=stand_in.url)
+            self.assertEqual(client.historical(self._date).dict,
+                             latest.dict)
+            client.pool.close()
+
+    def test_resilience(self):
+        """Tests retries, timeouts, hedged requests and the circuit breaker."""
+        class Unhealthy(_FakeAPI):
+            script, hits = [], 0  # Status, seconds stalled or "drop".
+
+            def do_GET(self):
+                Unhealthy.hits += 1
+                step = self.script.pop(0) if self.script else 200
+                if step == "drop":  # Close without answering.
+                    self.close_connection = True
+                    return None
+                if isinstance(step, float):
+                    time.sleep(step)
+                elif step != 200:
+                    return self.send_error(step)
+                super().do_GET()
+
+        server, url = _fake_api(Unhealthy)
+        retry = openexchangerate.Retry(attempts=3, backoff=0.01)
+        client = openexchangerate.OpenExchangeRates(
+            'DUMMY_API_KEY', base_url=url, timeout=0.3, connect_timeout=5,
+            retry=retry)
+        try:
+            Unhealthy.script[:] = [503, 502]
+            self.assertEqual(client.latest().dict["AED"], 3.6)
+            self.assertEqual(retry.retried, 2)
+            Unhealthy.script[:] = [404]
+            with self.assertRaises(openexchangerate.HTTPError):
+                client.latest()  # Not worth a retry.
+            self.assertEqual(retry.retried, 2)
+            Unhealthy.script[:] = [0.6]
+            start = time.monotonic()
+            client.latest()  # Read timeout, then a retry.
+            self.assertLess(time.monotonic() - start, 0.6)
+            self.assertEqual(retry.retried, 3)
+
+            retry.hedge, retry.hedge_after = True, 0.05
+            Unhealthy.script[:] = [0.6]
+            start = time.monotonic()
+            client.latest()  # Hedged, the 2nd request answers first.
+            self.assertLess(time.monotonic() - start, 0.3)
+            self.assertEqual((retry.retried, retry.hedged), (3, 1))
+            aclient = openexchangerate.AsyncOpenExchangeRates(
+                'DUMMY_API_KEY', base_url=url, retry=retry)
+            Unhealthy.script[:] = [0.6, 503]
+            self.assertEqual(asyncio.run(aclient.latest()).dict["AED"], 3.6)
+            self.assertEqual((retry.retried, retry.hedged), (4, 2))
+            retry.hedge = False
+            Unhealthy.script[:] = ["drop"]
+            self.assertEqual(asyncio.run(aclient.latest()).dict["AED"], 3.6)
+            self.assertEqual(retry.retried, 5)
+
+            breaker = openexchangerate.CircuitBreaker(failures=2, reset=0.2)
+            client = openexchangerate.OpenExchangeRates(
+                'DUMMY_API_KEY', base_url=url, breaker=breaker)
+            good = client.latest()
+            Unhealthy.script[:] = [503] * 3
+            Unhealthy.hits = 0
+            for _ in range(3):  # Last good rates, 3rd fails fast.
+                self.assertEqual(client.latest().dict, good.dict)
+            self.assertEqual((Unhealthy.hits, breaker.state), (2, "open"))
+            self.assertEqual(breaker.served_stale, 3)
+            with self.assertRaises(openexchangerate.CircuitOpen):
+                client.currencies()  # Nothing good to serve.
+            time.sleep(0.2)
+            self.assertEqual(client.latest().dict, good.dict)  # Trial, 503.
+            self.assertEqual(breaker.state, "open")
+            time.sleep(0.2)
+            client.latest()
+            self.assertEqual((Unhealthy.hits, breaker.state), (4, "closed"))
+
+            breaker = openexchangerate.CircuitBreaker(failures=1, reset=60)
+            aclient = openexchangerate.AsyncOpenExchangeRates(
+                'DUMMY_API_KEY', base_url=url, breaker=breaker)
+            good = asyncio.run(aclient.latest())
+            Unhealthy.script[:] = ["drop"]
+            stale = asyncio.run(aclient.latest())
+            self.assertEqual((stale.dict, stale.stale), (good.dict, True))
+            self.assertEqual((breaker.served_stale, breaker.state),
+                             (1, "open"))
+        finally:
+            server.shutdown()
+            server.server_close()
+            client.pool.close()
+
+    def test_stale_not_cached(self):
+        """Tests breaker stale rates skip the cache and keep refresh_error."""
+        old, new = (b'{"rates": {"USD": 1, "EUR": 0.9}}',
+                    b'{"rates": {"USD": 1, "EUR": 0.8}}')
+        replayer = openexchangerate.Replayer(
+            openexchangerate.RateArchive({"USD/latest.json": old}))
+        events = []
+        client = openexchangerate.OpenExchangeRates(
+            'DUMMY_API_KEY', transport=replayer, hooks=(events.append, ),
+            cache=openexchangerate.ResponseCache(ttl={"latest": 0.1}),
+            breaker=openexchangerate.CircuitBreaker(failures=1, reset=0))
+        self.assertFalse(client.latest().stale)
+        time.sleep(0.15)
+        replayer.drop_rate = 1.0
+        stale = client.latest()
+        self.assertTrue(stale.stale)
+        self.assertEqual(stale.dict["EUR"], 0.9)
+        self.assertEqual((events[-1]["status"], events[-1]["cache"]),
+                         (None, "stale"))
+        replayer.drop_rate = 0.0
+        replayer.archive.bodies["USD/latest.json"] = new
+        recovered = client.latest()  # Not a cache hit of the stale body.
+        self.assertEqual((recovered.dict["EUR"], recovered.stale),
+                         (0.8, False))
+
+        client = openexchangerate.OpenExchangeRates(
+            'DUMMY_API_KEY', transport=replayer,
+            breaker=openexchangerate.CircuitBreaker(failures=1, reset=60))
+        client.start_refresh(interval=0.02)
+        refreshed_at = client.refreshed_at
+        replayer.drop_rate = 1.0
+        for _ in range(100):
+            if isinstance(client.refresh_error,
+                          openexchangerate.CircuitOpen):
+                break
+            time.sleep(0.02)
+        time.sleep(0.05)
+        self.assertIsInstance(client.refresh_error,
+                              openexchangerate.CircuitOpen)
+        self.assertEqual(client.refreshed_at, refreshed_at)
+        self.assertFalse(client.latest().stale)
+        client.stop_refresh()
+        with self.assertRaises(openexchangerate.CircuitOpen):
+            client.start_refresh(interval=0.02)  # Only stale rates.
+
+    def test_stop_refresh_in_flight(self):
+        """Tests a refresh in flight during stop_refresh() is discarded."""
+        replayer = openexchangerate.Replayer(openexchangerate.RateArchive(
+            {"USD/latest.json": b'{"rates": {"USD": 1, "EUR": 0.9}}'}),
+            latency=0.2)
+        client = openexchangerate.OpenExchangeRates('DUMMY_API_KEY',
+                                                    transport=replayer)
+        client.start_refresh(interval=0.01)
+        time.sleep(0.05)  # The 2nd fetch is in flight.
+        client.stop_refresh()
+        time.sleep(0.3)
+        self.assertIsNone(client.refreshed_at)
+        self.assertEqual(replayer.requests, 2)
+        client.latest()
+        self.assertEqual(replayer.requests, 3)  # Not a frozen snapshot.
+
+        client.start_refresh(interval=0.01)
+        time.sleep(0.05)
+        client.start_refresh(interval=60)  # Old thread still in flight.
+        refreshed_at = client.refreshed_at
+        time.sleep(0.3)
+        self.assertEqual(client.refreshed_at, refreshed_at)
+        client.stop_refresh()
+
+    def test_snapshot_store_decimal(self):
+        """Tests Decimal clients get the API digits, not stored float64."""
+        body = (b'{"rates": {"USD": 1, "EUR": 0.90, '
+                b'"BTC": 0.0000157012345678901234}}')
+        replayer = openexchangerate.Replayer(openexchangerate.RateArchive(
+            {"USD/historical/2018-01-01.json": body}))
+        expected = {"USD": decimal.Decimal("1"),
+                    "EUR": decimal.Decimal("0.90"),
+                    "BTC": decimal.Decimal("0.0000157012345678901234")}
+        with tempfile.TemporaryDirectory() as folder:
+            store = openexchangerate.SnapshotStore(
+                os.path.join(folder, "rates.oxr"))
+            client = openexchangerate.OpenExchangeRates(
+                'DUMMY_API_KEY', use_float=False, store=store,
+                transport=replayer)
+            for _ in range(2):
+                rates = client.historical("2018-01-01").dict
+                self.assertEqual(tuple(map(str, rates.values())),
+                                 tuple(map(str, expected.values())))
+            self.assertEqual(replayer.requests, 2)  # Store not read.
+            self.assertIn(("2018-01-01", "USD"), store)  # But filled.
+            floats = openexchangerate.OpenExchangeRates(
+                'DUMMY_API_KEY', store=store, round_float=False,
+                transport=replayer)
+            self.assertEqual(floats.historical("2018-01-01").dict["EUR"], 0.9)
+            self.assertEqual(replayer.requests, 2)